@@ -18,7 +18,19 @@ setup(
         "Operating System :: OS Independent",
     ],
     python_requires=">=3.8",
-    install_requires=["pydantic", "ujson", "glide==0.2.29", "nltk", "click", "pytest"],
-    extras_require={"all": ["graphviz", "Columnar", "Pympler"]},
+    install_requires=[
+        "pydantic",
+        "ujson",
+        "glide==0.2.29",
+        "nltk",
+        "click",
+        "sqlalchemy",
+        "pytest",
+    ],
+    extras_require={
+        "all": ["graphviz", "Columnar", "Pympler", "zstandard", "pyarrow"],
+        "zstd": ["zstandard"],
+        "parquet": ["pyarrow"],
+    },
     entry_points={"console_scripts": ["toi=terms_of_interest.cli:cli"]},
 )
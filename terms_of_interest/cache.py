@@ -0,0 +1,56 @@
+import hashlib
+import os
+
+from . import storage
+
+
+class MatcherCache:
+    """On-disk cache of built matchers, keyed by a hash of their inputs.
+
+    The key covers the storage format version, the matcher class, its
+    tokenizer and the contents of the term files, so editing a termset or
+    switching algorithm builds a new entry. Without a directory, or for
+    matchers that can't be saved, matchers are just built.
+    """
+
+    suffix = ".toim"
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, cls, filepaths):
+        digest = hashlib.sha256()
+        digest.update(f"{storage.VERSION}:{cls.__module__}.{cls.__qualname__}".encode())
+        digest.update(repr(getattr(cls(), "tokenizer", None)).encode())
+        for filepath in filepaths:
+            with open(filepath, "rb") as fd:
+                content = fd.read()
+            digest.update(len(content).to_bytes(8, "little"))
+            digest.update(content)
+        return digest.hexdigest()
+
+    def path(self, cls, filepaths):
+        return os.path.join(self.directory, self.key(cls, filepaths) + self.suffix)
+
+    def get(self, cls, filepaths, build):
+        """Loads the matcher for `filepaths` or calls `build` and saves it."""
+        if not self.directory or not hasattr(cls, "load"):
+            return build()
+
+        path = self.path(cls, filepaths)
+        try:
+            return cls.load(path)
+        except (OSError, ValueError):
+            pass
+
+        matcher = build()
+        matcher.save(path)
+        return matcher
+
+    def from_txtfile(self, cls, filepath):
+        return self.get(cls, [filepath], lambda: cls.from_txtfile(filepath))
+
+    def from_txtfiles(self, cls, filepaths):
+        return self.get(cls, filepaths, lambda: cls.from_txtfiles(filepaths))
@@ -0,0 +1,125 @@
+import os
+
+import ujson
+
+from . import storage, util
+
+
+class Checkpoint:
+    """Progress of a run through its input files, saved to a JSON state file.
+
+    For each file the byte ranges whose results were written are recorded,
+    along with the size of each output file and the last database row id at
+    that point, and with dedup the path of the saved bloom filter, which
+    alternates between two files so the previous one stays valid until the
+    new state, synced after it, replaces it.  Resuming skips the recorded
+    ranges, truncates the outputs back to their recorded sizes and deletes
+    later rows, so results are neither lost nor duplicated.  Files are
+    identified by their path, size and mtime, a file that changed since is
+    processed again.
+    """
+
+    version = 1
+
+    def __init__(self, path, interval=64 * 1024 ** 2):
+        self.path = path
+        self.interval = interval
+        self.files = {}
+        self.outputs = {}
+        self.db = None
+        self.dedup = None
+        self.pending = 0
+
+    def load(self):
+        """Loads the saved state, if any.  Returns whether there was one."""
+        try:
+            with open(self.path) as fd:
+                state = ujson.load(fd)
+        except FileNotFoundError:
+            return False
+        if state.get("version") != self.version:
+            raise ValueError(f"Unsupported checkpoint version in {self.path}")
+        self.files = state["files"]
+        self.outputs = state["outputs"]
+        self.db = state["db"]
+        self.dedup = state.get("dedup")
+        return True
+
+    def save(self, outputs, db=None, dedup=None):
+        self.outputs = outputs
+        self.db = db
+        if dedup is not None:
+            dedup_path = os.path.abspath(f"{self.path}.dedup0")
+            if self.dedup == dedup_path:
+                dedup_path = os.path.abspath(f"{self.path}.dedup1")
+            dedup.save(dedup_path)
+            self.dedup = dedup_path
+        state = dict(
+            version=self.version,
+            files=self.files,
+            outputs=outputs,
+            db=db,
+            dedup=self.dedup,
+        )
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fd:
+            ujson.dump(state, fd, indent=2, escape_forward_slashes=False)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_path, self.path)
+        storage.fsync_directory(self.path)
+        self.pending = 0
+
+    def file(self, path):
+        """Returns the state of `path`, reset if the file changed since."""
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        state = self.files.get(key)
+        if not state or (state["size"], state["mtime_ns"]) != (
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            state = self.files[key] = dict(
+                size=stat.st_size, mtime_ns=stat.st_mtime_ns, done=[]
+            )
+        return state
+
+    def mark(self, path, start, end):
+        """Records the `[start, end)` byte range of `path` as processed."""
+        ranges = self.file(path)["done"]
+        ranges.append([start, end])
+        ranges.sort()
+        merged = [ranges[0]]
+        for lo, hi in ranges[1:]:
+            if lo <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], hi)
+            else:
+                merged.append([lo, hi])
+        ranges[:] = merged
+        self.pending += end - start
+
+    @property
+    def due(self):
+        return self.pending >= self.interval
+
+    def remaining(self, shards):
+        """Yields the parts of `shards` that weren't processed yet.
+
+        Compressed files are only recorded whole, so they are either skipped
+        or read again from the start.
+        """
+        for shard in shards:
+            path, start, end = util.to_shard(shard)
+            done = self.file(path)["done"]
+            if util.detect_compression(path):
+                if not any(lo <= start and end <= hi for lo, hi in done):
+                    yield (path, start, end)
+                continue
+            for lo, hi in done:
+                if lo > start:
+                    if lo >= end:
+                        break
+                    yield (path, start, lo)
+                start = max(start, hi)
+            if start < end:
+                yield (path, start, end)
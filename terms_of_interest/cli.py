@@ -1,6 +1,15 @@
+import os
+
 import click
 
+from . import util
+from .checkpoint import Checkpoint
+from .dedup import RotatingBloomFilter
+from .index import DateIndex
 from .pipeline import PipelineBuilder
+from .schemas import decoders
+from .sinks import sinks
+from .stats import PipelineStats
 from .tools.verify import ResultsVerifier
 from .tools.visualize import GraphVisualizer
 from .tools import benchmarks
@@ -8,12 +17,44 @@ from .tools import benchmarks
 
 class CLIPipeline(PipelineBuilder):
     def __init__(self, cliargs, *args, **kwargs):
-        units = (
-            dict(userset=cliargs["unit1_userset"], termset=cliargs["unit1_termset"]),
-            dict(userset=cliargs["unit2_userset"], termset=cliargs["unit2_termset"]),
-        )
-        if "db_uri" in cliargs:
-            kwargs["db_uri"] = cliargs["db_uri"]
+        units = cliargs.get("units") or [
+            {
+                kind: unit_option(cliargs, idx, kind, path)
+                for kind, path in default.items()
+            }
+            for idx, default in enumerate(self.default_units, start=1)
+        ]
+        for key in ("db_uri", "db_load", "db_batch_size", "db_schema"):
+            if key in cliargs:
+                kwargs[key] = cliargs[key]
+        if "sqlite_pragma" in cliargs:
+            kwargs["db_pragmas"] = cliargs["sqlite_pragma"]
+        if "decode" in cliargs:
+            kwargs["schema"] = decoders[cliargs["decode"]]
+        if "merge_units" in cliargs:
+            kwargs["merge_units"] = cliargs["merge_units"]
+        if "cache_dir" in cliargs:
+            kwargs["cache_dir"] = cliargs["cache_dir"]
+        for key in ("output_format", "output", "partition_by"):
+            if key in cliargs:
+                kwargs[key] = cliargs[key]
+        if cliargs.get("checkpoint"):
+            kwargs["checkpoint"] = Checkpoint(
+                cliargs["checkpoint"], interval=cliargs["checkpoint_size"] * 2 ** 20
+            )
+        if cliargs.get("dedup"):
+            kwargs["dedup"] = RotatingBloomFilter(
+                max_bytes=cliargs["dedup_memory"] * 2 ** 20,
+                error_rate=cliargs["dedup_error_rate"],
+            )
+        if "match_cache_size" in cliargs:
+            kwargs["match_cache_size"] = cliargs["match_cache_size"]
+        if "batch" in cliargs:
+            kwargs["batch"] = cliargs["batch"]
+        if cliargs.get("chunk_size"):
+            kwargs["chunk_size"] = cliargs["chunk_size"] * 1024
+        if cliargs.get("stats") or cliargs.get("stats_file"):
+            kwargs["stats"] = PipelineStats()
         super().__init__(*args, units=units, **kwargs)
 
     def set_context(self, cliargs):
@@ -21,7 +62,48 @@ class CLIPipeline(PipelineBuilder):
             termset_algo=cliargs["termset_algo"],
             execution_date=cliargs["execution_date"],
             format_template=cliargs["format_template"],
+            userset_algo=cliargs["userset_algo"],
+        )
+
+
+def unit_option(cliargs, idx, kind, default):
+    """Returns the `--unit{idx}_{kind}` file, or `default` if it exists.
+
+    Defaults are resolved here rather than by click so `check_units` can tell
+    whether the options were given.
+    """
+    option = f"unit{idx}_{kind}"
+    if cliargs[option]:
+        return cliargs[option]
+    if not os.path.exists(default):
+        raise click.BadParameter(
+            f'Path "{default}" does not exist.', param_hint=f"'--{option}'"
         )
+    return default
+
+
+def parse_pragmas(ctx, param, values):
+    try:
+        return dict(value.split("=", 1) for value in values)
+    except ValueError:
+        raise click.BadParameter("pragmas must be given as NAME=VALUE")
+
+
+def parse_units(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return util.read_units(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
+sqlite_pragma_option = click.option(
+    "--sqlite-pragma",
+    multiple=True,
+    callback=parse_pragmas,
+    help="SQLite pragma to set on connect, e.g. journal_mode=WAL (repeatable)",
+)
 
 
 @click.group()
@@ -46,14 +128,25 @@ def plot(filepath):
 @click.argument(
     "results", type=click.Path(exists=True, readable=True), required=True,
 )
-def verify(data, results):
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker processes to verify DATA with",
+)
+@click.option(
+    "--progress/--no-progress",
+    default=True,
+    help="Report progress and throughput while reading DATA",
+)
+def verify(data, results, workers, progress):
     """Verifies the results of `run` command.
 
     DATA is the path to the DATA FILE.
     RESULTS is the path to the RESULTS FILE.
     """
-    with open(data) as tweets_file, open(results) as results_file:
-        ResultsVerifier().run(tweets_file, results_file)
+    with open(results) as results_file:
+        ResultsVerifier(workers=workers, progress=progress).run(data, results_file)
 
 
 @click.command("graphvis")
@@ -75,100 +168,432 @@ def graphvis(term_files):
 
 
 @click.command("benchmark")
-@click.option(
-    "--top-ngrams",
-    type=int,
-    default=100,
-    required=True,
-    help="Number of ngrams to use as seed in term generation.",
-)
 @click.option(
     "--runs", type=int, default=1, required=True, help="Number of times to run algos."
 )
 @click.option(
     "--algos",
     type=str,
-    default="Naive List,Naive Set,Trie,Aho-Corasick",
+    default=(
+        "Naive List,Naive Set,Trie,Aho-Corasick,Compiled Aho-Corasick,"
+        "Double-Array Aho-Corasick"
+    ),
     required=True,
     help="Algos to include.",
 )
+@click.option("--seed", type=int, default=0, help="Seed for the synthetic data.")
+@click.option("--tweets", type=int, default=10000, help="Number of synthetic tweets.")
+@click.option("--words-per-tweet", type=int, default=20, help="Words per tweet.")
+@click.option("--vocab-size", type=int, default=5000, help="Number of distinct words.")
+@click.option(
+    "--skew",
+    type=float,
+    default=1.1,
+    help="Zipf exponent of word frequencies, 0 for uniform.",
+)
+@click.option("--terms", type=int, default=1000, help="Number of terms per termset.")
+@click.option(
+    "--pipeline/--no-pipeline",
+    default=True,
+    help="Also benchmark end-to-end pipeline runs.",
+)
+@click.option(
+    "--memory", is_flag=True, default=False, help="Measure matcher memory (slow)."
+)
 @click.option(
     "--fileid",
     type=str,
-    default="melville-moby_dick.txt",
-    required=True,
-    help="Gutenberg file to benchmark against.",
+    default=None,
+    help="Benchmark matchers against a Gutenberg file instead of synthetic data.",
+)
+@click.option(
+    "--top-ngrams",
+    type=int,
+    default=100,
+    help="Number of ngrams to use as seed in term generation with --fileid.",
+)
+@click.option(
+    "--output", type=click.Path(dir_okay=False), help="Write results as JSON."
+)
+@click.option(
+    "--compare",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON results to compare against, exits 1 on regressions.",
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="Fraction a metric may get worse by before it is a regression.",
 )
-def benchmark(top_ngrams, runs, algos, fileid):
+def benchmark(algos, **kwargs):
     """Benchmark and print summaries of the performance results of different data structures."""
-    benchmarks.main(
-        fileid=fileid,
-        algos_to_include=algos.split(","),
-        top_ngrams=top_ngrams,
-        words_per_sentence=30,
-        runs=runs,
-    )
+    regressions = benchmarks.main(algos_to_include=algos.split(","), **kwargs)
+    if regressions:
+        raise SystemExit(1)
 
 
-@click.command("run")
+@click.command("index")
 @click.argument(
     "data", type=click.Path(exists=True, readable=True), nargs=-1, required=True
 )
+def index(data):
+    """Writes a date index sidecar for each DATA file.
+
+    DATA is the path to the data files to be indexed.  `run` uses the index
+    to read only the tweets of the `--execution-date` day.
+    """
+    for path in data:
+        try:
+            date_index = DateIndex.build(path).save()
+        except ValueError as exc:
+            click.echo(f"Skipping {path}: {exc}", err=True)
+            continue
+        click.echo(f"{DateIndex.sidecar(path)}: {len(date_index.days)} days")
+
+
+@click.command("benchmark-db")
 @click.option(
-    "--execution-date",
-    type=click.DateTime(),
-    default=None,
-    help="Only process tweets for date given",
+    "--db-uri",
+    type=str,
+    default="sqlite:///benchmark.db",
+    help="Database URI string for SQLAlchemy",
 )
+@click.option("--rows", type=int, default=10000, help="Number of results to load.")
 @click.option(
-    "--format-template",
-    type=str,
-    default="{r.term}, {r.message_id}",
-    help="String template for output",
+    "--batch-size", type=int, default=1000, help="Number of results per transaction."
 )
+@sqlite_pragma_option
+def benchmark_db(db_uri, rows, batch_size, sqlite_pragma):
+    """Benchmark and print summaries of loading results into a database."""
+    benchmarks.db_main(
+        db_uri=db_uri, rows=rows, batch_size=batch_size, sqlite_pragmas=sqlite_pragma
+    )
+
+
+@click.command("benchmark-reader")
+@click.argument("data", type=click.Path(exists=True, readable=True), required=True)
+@click.option("--runs", type=int, default=1, help="Number of times to read DATA.")
+def benchmark_reader(data, runs):
+    """Benchmark and print summaries of reading DATA with different readers."""
+    benchmarks.reader_main(data, runs=runs)
+
+
+pipeline_options = [
+    click.option(
+        "--execution-date",
+        type=click.DateTime(),
+        default=None,
+        help="Only process tweets for date given",
+    ),
+    click.option(
+        "--format-template",
+        type=str,
+        default="{r.term}, {r.message_id}",
+        help="String template for output",
+    ),
+    click.option(
+        "--output-format",
+        type=click.Choice(list(sinks)),
+        default="text",
+        help="Write results as templated text, JSONL, CSV or Parquet",
+    ),
+    click.option(
+        "--output",
+        type=click.Path(),
+        default=None,
+        help="File, or directory with --partition-by, to write results to [default: stdout]",
+    ),
+    click.option(
+        "--partition-by",
+        type=click.Choice(["unit", "day"]),
+        default=None,
+        help="Write results to one file per unit or per day under --output",
+    ),
+    click.option(
+        "--termset-algo",
+        type=click.Choice(
+            [
+                "NaiveList",
+                "NaiveSet",
+                "Trie",
+                "AhoCorasick",
+                "CompiledAhoCorasick",
+                "DoubleArrayAhoCorasick",
+            ]
+        ),
+        default="AhoCorasick",
+        help="Algorithm for search termsets",
+    ),
+    click.option(
+        "--userset-algo",
+        type=click.Choice(["Set", "IntSet"]),
+        default="Set",
+        help="Store usersets as sets of strings (Set) or sorted integer arrays (IntSet)",
+    ),
+    click.option(
+        "--decode",
+        type=click.Choice(list(decoders)),
+        default="fast",
+        help="Decode tweets without validation (fast) or with full validation (strict)",
+    ),
+    click.option(
+        "--merge-units",
+        is_flag=True,
+        default=False,
+        help="Match all units with one merged automaton",
+    ),
+    click.option(
+        "--dedup",
+        is_flag=True,
+        default=False,
+        help="Drop tweets whose message_id was already seen",
+    ),
+    click.option(
+        "--dedup-memory",
+        type=click.IntRange(min=1),
+        default=64,
+        help="MiB of memory to remember seen message_ids in",
+    ),
+    click.option(
+        "--dedup-error-rate",
+        type=click.FloatRange(min=1e-12, max=0.5),
+        default=1e-6,
+        help="Rate of new tweets wrongly dropped as duplicates",
+    ),
+    click.option(
+        "--match-cache-size",
+        type=click.IntRange(min=0),
+        default=0,
+        help="Number of distinct texts to cache the matches of per termset",
+    ),
+    click.option(
+        "--batch",
+        is_flag=True,
+        default=False,
+        help="Push lists of records through the pipeline instead of one at a time",
+    ),
+    click.option(
+        "--cache-dir",
+        type=click.Path(file_okay=False),
+        default=None,
+        help="Directory to cache built matchers in between runs",
+    ),
+    click.option(
+        "--db-uri",
+        type=str,
+        default="sqlite:///:memory:",
+        help="Database URI string for SQLAlchemy",
+    ),
+    click.option(
+        "--db-load",
+        is_flag=True,
+        default=False,
+        help="Load results into the database at --db-uri",
+    ),
+    click.option(
+        "--db-batch-size",
+        type=click.IntRange(min=1),
+        default=1000,
+        help="Number of results written per database transaction",
+    ),
+    click.option(
+        "--db-schema",
+        type=click.Choice(["simple", "compact"]),
+        default="simple",
+        help="Store results as plain rows (simple) or with a terms table (compact)",
+    ),
+    sqlite_pragma_option,
+    click.option(
+        "--stats",
+        is_flag=True,
+        default=False,
+        help="Print per-node counts and timings to stderr after the run",
+    ),
+    click.option(
+        "--stats-file",
+        type=click.Path(dir_okay=False),
+        default=None,
+        help="Write per-node stats as Prometheus text (.prom) or JSON",
+    ),
+    click.option(
+        "--units",
+        type=click.Path(exists=True, dir_okay=False),
+        default=None,
+        callback=parse_units,
+        help="JSON config of any number of units, instead of --unit1_* and --unit2_*",
+    ),
+    click.option(
+        "--unit1_userset",
+        type=click.Path(exists=True, readable=True),
+        default=None,
+        help="File containing the node ids for unit 1 [default: data/nodes1.txt]",
+    ),
+    click.option(
+        "--unit1_termset",
+        type=click.Path(exists=True, readable=True),
+        default=None,
+        help="File containing the terms for unit 1 [default: data/terms1.txt]",
+    ),
+    click.option(
+        "--unit2_userset",
+        type=click.Path(exists=True, readable=True),
+        default=None,
+        help="File containing the node ids for unit 2 [default: data/nodes2.txt]",
+    ),
+    click.option(
+        "--unit2_termset",
+        type=click.Path(exists=True, readable=True),
+        default=None,
+        help="File containing the terms ids for unit 2 [default: data/terms2.txt]",
+    ),
+]
+
+
+def add_options(options):
+    def decorator(func):
+        for option in reversed(options):
+            func = option(func)
+        return func
+
+    return decorator
+
+
+def check_output(cliargs):
+    if not cliargs["output"] and (
+        cliargs["partition_by"] or cliargs["output_format"] == "parquet"
+    ):
+        raise click.UsageError("--output is required for this output format")
+
+
+def check_units(cliargs):
+    options = [f"unit{idx}_{kind}" for idx in (1, 2) for kind in ("userset", "termset")]
+    if cliargs["units"] and any(cliargs[option] for option in options):
+        raise click.UsageError("--units can't be combined with --unit1_* or --unit2_*")
+
+
+def report(pipeline, cliargs):
+    if pipeline.dedup:
+        click.echo(f"Skipped {pipeline.dedup.duplicates} duplicate messages", err=True)
+    for name, termset in pipeline.match_caches().items():
+        hits, misses = termset.cache_counts()
+        rate = hits / (hits + misses) if hits + misses else 0
+        click.echo(
+            f"{name} match cache: {hits} hits, {misses} misses ({rate:.1%} hit rate)",
+            err=True,
+        )
+    if cliargs["stats"]:
+        click.echo(pipeline.stats.format_table(), err=True)
+    if cliargs["stats_file"]:
+        pipeline.stats.write(cliargs["stats_file"])
+
+
+@click.command("run")
+@click.argument(
+    "data", type=click.Path(exists=True, readable=True), nargs=-1, required=True
+)
+@add_options(pipeline_options)
 @click.option(
-    "--termset-algo",
-    type=click.Choice(["NaiveList", "NaiveSet", "Trie", "AhoCorasick"]),
-    default="AhoCorasick",
-    help="Algorithm for search termsets",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker processes to shard the input across",
 )
 @click.option(
-    "--db-uri",
-    type=str,
-    default="sqlite:///:memory:",
-    help="Database URI string for SQLAlchemy",
+    "--ordered",
+    is_flag=True,
+    default=False,
+    help="Keep output in input order when running with workers",
 )
 @click.option(
-    "--unit1_userset",
-    type=click.Path(exists=True, readable=True),
-    default="data/nodes1.txt",
-    help="File containing the node ids for unit 1",
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=64,
+    help="KiB of input read at a time, the size of the batches with --batch",
 )
 @click.option(
-    "--unit1_termset",
-    type=click.Path(exists=True, readable=True),
-    default="data/terms1.txt",
-    help="File containing the terms for unit 1",
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="State file to record the progress of the run in",
 )
 @click.option(
-    "--unit2_userset",
-    type=click.Path(exists=True, readable=True),
-    default="data/nodes2.txt",
-    help="File containing the node ids for unit 2",
+    "--checkpoint-size",
+    type=click.IntRange(min=1),
+    default=64,
+    help="MiB of input processed between checkpoints",
 )
 @click.option(
-    "--unit2_termset",
-    type=click.Path(exists=True, readable=True),
-    default="data/terms2.txt",
-    help="File containing the terms ids for unit 2",
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Skip the input recorded in --checkpoint and roll outputs back to it",
 )
 def run(data, **cliargs):
     """Runs the data processing pipeline.
 
     DATA is the path to the data files to be processed.
     """
-    CLIPipeline(cliargs).build().set_context(cliargs).run(data)
+    check_output(cliargs)
+    check_units(cliargs)
+    if cliargs["resume"] and not cliargs["checkpoint"]:
+        raise click.UsageError("--resume requires --checkpoint")
+    if cliargs["checkpoint"] and cliargs["output_format"] == "parquet":
+        raise click.UsageError("Parquet output can't be checkpointed")
+    pipeline = CLIPipeline(cliargs).build().set_context(cliargs)
+    pipeline.run(
+        data,
+        workers=cliargs["workers"],
+        ordered=cliargs["ordered"],
+        resume=cliargs["resume"],
+    )
+    report(pipeline, cliargs)
+
+
+@click.command("stream")
+@click.argument(
+    "source",
+    type=click.Path(exists=True, dir_okay=False, allow_dash=True),
+    default="-",
+)
+@add_options(pipeline_options)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    help="Maximum number of lines per micro-batch",
+)
+@click.option(
+    "--queue-size",
+    type=click.IntRange(min=1),
+    default=16,
+    help="Number of batches read ahead of the pipeline before reading pauses",
+)
+def stream(source, **cliargs):
+    """Runs the data processing pipeline over a stream of tweets.
+
+    SOURCE is a file or named pipe to read tweets from until it ends, or -
+    for stdin.  Results are flushed after every micro-batch.
+    """
+    check_output(cliargs)
+    check_units(cliargs)
+    pipeline = CLIPipeline(cliargs).build(stream=True).set_context(cliargs)
+    with click.open_file(source, "rb") as fd:
+        pipeline.run_stream(
+            fd, batch_size=cliargs["batch_size"], queue_size=cliargs["queue_size"]
+        )
+    report(pipeline, cliargs)
 
 
-for cmd in [plot, verify, graphvis, benchmark, run]:
+for cmd in [
+    plot,
+    verify,
+    graphvis,
+    benchmark,
+    benchmark_db,
+    benchmark_reader,
+    index,
+    run,
+    stream,
+]:
     cli.add_command(cmd)
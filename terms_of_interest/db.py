@@ -1,14 +1,23 @@
 from datetime import date
+import queue
+import threading
 
 from sqlalchemy import (
     create_engine,
+    event,
+    BigInteger,
     Column,
-    String,
-    Integer,
     Date,
+    ForeignKey,
+    Index,
+    Integer,
+    SmallInteger,
+    String,
+    func,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 Base = declarative_base()
 
@@ -22,16 +31,188 @@ class Results(Base):
     created_on = Column(Date(), default=date.today)
 
 
+class Terms(Base):
+    __tablename__ = "terms"
+
+    id = Column(Integer(), primary_key=True)
+    term = Column(String(255), nullable=False, unique=True)
+
+
+class CompactResults(Base):
+    """Results referencing the `terms` dictionary, with numeric message ids"""
+
+    __tablename__ = "compact_results"
+    __table_args__ = (
+        Index("ix_compact_results_created_on_term_id", "created_on", "term_id"),
+    )
+
+    id = Column(Integer(), primary_key=True)
+    term_id = Column(Integer(), ForeignKey("terms.id"), nullable=False)
+    message_id = Column(BigInteger(), nullable=False)
+    unit = Column(SmallInteger())
+    created_on = Column(Date(), default=date.today)
+
+
 class DataAccessLayer:
-    def __init__(self, conn_string="sqlite:///:memory:"):
+    def __init__(self, conn_string="sqlite:///:memory:", sqlite_pragmas=None):
         self.engine = None
         self.conn_string = conn_string
+        self.sqlite_pragmas = sqlite_pragmas or {}
+
+    def set_sqlite_pragmas(self, dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        for name, value in self.sqlite_pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
 
     def connect(self):
-        self.engine = create_engine(self.conn_string)
+        kwargs = {}
+        if self.conn_string in ("sqlite://", "sqlite:///:memory:"):
+            # Share the one in-memory database with writer threads
+            kwargs = dict(
+                poolclass=StaticPool, connect_args={"check_same_thread": False}
+            )
+        self.engine = create_engine(self.conn_string, **kwargs)
+        if self.sqlite_pragmas and self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", self.set_sqlite_pragmas)
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
         return self
 
 
+class BulkWriter:
+    """Buffers rows and inserts them in batches with one transaction per batch.
+
+    With `threaded`, batches are handed to a background writer thread through
+    a queue of at most `queue_size` batches, so callers only wait on the
+    database when it falls that far behind.
+    """
+
+    model = Results
+
+    def __init__(
+        self, engine, model=None, batch_size=1000, threaded=True, queue_size=8
+    ):
+        self.engine = engine
+        self.table = (model or self.model).__table__
+        self.batch_size = batch_size
+        self.threaded = threaded
+        self.rows = []
+        self.written = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+
+    def to_row(self, result):
+        return dict(term=result.term, message_id=result.message_id)
+
+    def add(self, result):
+        self.rows.append(self.to_row(result))
+        if len(self.rows) >= self.batch_size:
+            self.submit()
+
+    def submit(self):
+        rows, self.rows = self.rows, []
+        if not rows:
+            return
+        if not self.threaded:
+            return self.write(rows)
+
+        self.raise_error()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, daemon=True)
+            self.thread.start()
+        self.queue.put(rows)
+
+    def flush(self):
+        """Writes buffered rows and waits until every batch is committed."""
+        self.submit()
+        if self.thread is not None:
+            self.queue.join()
+        self.raise_error()
+
+    def write(self, rows):
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), rows)
+        self.written += len(rows)
+
+    def position(self):
+        """Commits buffered rows and returns the last row id of the table."""
+        self.flush()
+        with self.engine.begin() as conn:
+            return conn.execute(func.max(self.table.c.id)).scalar() or 0
+
+    def restore(self, position):
+        """Deletes the rows added after the row id `position`."""
+        with self.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.id > position))
+
+    def work(self):
+        while True:
+            rows = self.queue.get()
+            try:
+                if self.error is None:
+                    self.write(rows)
+            except Exception as exc:
+                self.error = exc
+            finally:
+                self.queue.task_done()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+class CompactBulkWriter(BulkWriter):
+    """BulkWriter for `CompactResults`, adding unseen terms to `Terms`."""
+
+    model = CompactResults
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.terms = Terms.__table__
+        self.term_ids = {}
+
+    def to_row(self, result):
+        return (result.term, int(result.message_id), result.unit)
+
+    def resolve_terms(self, conn, terms):
+        """Returns the ids of terms that are not cached yet, adding new terms."""
+        missing = set(terms) - self.term_ids.keys()
+        found = {}
+        if not missing:
+            return found
+
+        query = self.terms.select().where(self.terms.c.term.in_(missing))
+        found.update((row.term, row.id) for row in conn.execute(query))
+        missing -= found.keys()
+        if missing:
+            conn.execute(self.terms.insert(), [dict(term=term) for term in missing])
+            query = self.terms.select().where(self.terms.c.term.in_(missing))
+            found.update((row.term, row.id) for row in conn.execute(query))
+        return found
+
+    def write(self, rows):
+        with self.engine.begin() as conn:
+            found = self.resolve_terms(conn, {term for term, _, _ in rows})
+            term_ids = self.term_ids
+            conn.execute(
+                self.table.insert(),
+                [
+                    dict(
+                        term_id=term_ids.get(term) or found[term],
+                        message_id=message_id,
+                        unit=unit,
+                    )
+                    for term, message_id, unit in rows
+                ],
+            )
+        self.term_ids.update(found)
+        self.written += len(rows)
+
+
+writers = {"simple": BulkWriter, "compact": CompactBulkWriter}
+
+
 # dal = DataAccessLayer("sqlite:///results.db").connect()
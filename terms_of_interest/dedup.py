@@ -0,0 +1,132 @@
+from collections import deque
+import math
+
+from . import storage
+
+MASK64 = 2 ** 64 - 1
+
+
+def mix64(x):
+    """Scrambles a 64-bit integer, sequential snowflake ids included."""
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK64
+    return x ^ (x >> 31)
+
+
+class RotatingBloomFilter:
+    """Remembers recently added integers in at most `max_bytes` of memory.
+
+    Integers are added to the newest of up to `generations` bloom filters of
+    `max_bytes / generations` bytes each.  Generations are allocated as they
+    fill up, and once there are `generations` of them the oldest is dropped,
+    forgetting the integers added first.  Each generation is sized for a
+    false positive rate of `error_rate / generations`, so lookups over all
+    of them stay under `error_rate`.  The number of hashes is capped at
+    `max_hashes`, since each one costs a Python level probe, at the expense
+    of a few more bits per integer.
+
+    n = integers per generation
+    k = hashes per integer, min(-log2(error_rate / generations), max_hashes)
+
+    Space: max_bytes, -k / ln(1 - (error_rate / generations) ** (1 / k)) bits
+           per integer
+    Time: O(k * generations) per integer
+    """
+
+    def __init__(
+        self, max_bytes=64 * 1024 ** 2, error_rate=1e-6, generations=4, max_hashes=12
+    ):
+        self.max_bytes = max_bytes
+        self.generations = generations
+        self.error_rate = error_rate
+        self.max_hashes = max_hashes
+        self.size = max(max_bytes // generations, 1) * 8
+        generation_error = error_rate / generations
+        self.hashes = max(1, min(round(-math.log2(generation_error)), max_hashes))
+        bits_per_item = -self.hashes / math.log1p(
+            -(generation_error ** (1 / self.hashes))
+        )
+        self.capacity = max(1, int(self.size / bits_per_item))
+        self.filters = deque()
+        self.count = 0
+        self.duplicates = 0
+
+    def resized(self, max_bytes):
+        """Returns an empty filter with the same settings in `max_bytes`."""
+        return type(self)(max_bytes, self.error_rate, self.generations, self.max_hashes)
+
+    @property
+    def nbytes(self):
+        return sum(len(bloom) for bloom in self.filters)
+
+    def probes(self, item):
+        h = mix64(item)
+        h1, h2 = h >> 32, h & 0xFFFFFFFF | 1
+        return range(h1, h1 + self.hashes * h2, h2)
+
+    def contains(self, item, probes=None):
+        size = self.size
+        for bloom in self.filters:
+            for pos in probes or self.probes(item):
+                pos %= size
+                if not bloom[pos >> 3] & 1 << (pos & 7):
+                    break
+            else:
+                return True
+        return False
+
+    def add(self, item):
+        """Adds `item`, returns whether it was probably added before."""
+        probes = self.probes(item)
+        if self.contains(item, probes):
+            self.duplicates += 1
+            return True
+
+        if not self.filters or self.count >= self.capacity:
+            if len(self.filters) >= self.generations:
+                self.filters.popleft()
+            self.filters.append(bytearray(self.size // 8))
+            self.count = 0
+        bloom, size = self.filters[-1], self.size
+        for pos in probes:
+            pos %= size
+            bloom[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+        return False
+
+    def drain_counters(self):
+        duplicates, self.duplicates = self.duplicates, 0
+        return duplicates
+
+    def merge_counters(self, duplicates):
+        self.duplicates += duplicates
+
+    def save(self, path):
+        """Saves the generations to `path`, synced to disk."""
+        meta = dict(
+            size=self.size,
+            hashes=self.hashes,
+            count=self.count,
+            generations=len(self.filters),
+        )
+        sections = dict(filters=b"".join(self.filters))
+        storage.save_sections(path, type(self).__name__, meta, sections, durable=True)
+
+    def restore(self, path):
+        """Replaces the generations with those saved to `path`.
+
+        The filter must have been saved with the same size and hashes.
+        """
+        meta, sections = storage.load_sections(path, type(self).__name__)
+        if (meta["size"], meta["hashes"]) != (self.size, self.hashes):
+            raise ValueError(f"{path} was saved with other dedup settings")
+        data, nbytes = sections["filters"], self.size // 8
+        self.filters = deque(
+            bytearray(data[idx * nbytes : (idx + 1) * nbytes])
+            for idx in range(meta["generations"])
+        )
+        self.count = meta["count"]
+        return self
+
+    def __contains__(self, item):
+        return self.contains(item)
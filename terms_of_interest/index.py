@@ -0,0 +1,122 @@
+from datetime import date, datetime, timezone
+import functools
+import os
+import re
+
+import ujson
+
+from . import util
+from .schemas import parse_timestamp
+
+# Twitter snowflake ids carry a millisecond timestamp relative to this epoch
+SNOWFLAKE_EPOCH = 1288834974657
+# Ids below the first snowflake id carry no timestamp
+SNOWFLAKE_MIN_ID = 29700859247
+DAY_MS = 24 * 60 * 60 * 1000
+MESSAGE_ID = re.compile(rb'"message_id"\s*:\s*"?(\d+)')
+
+
+def snowflake_timestamp(message_id):
+    """Returns the UTC epoch milliseconds encoded in a snowflake message id."""
+    return (int(message_id) >> 22) + SNOWFLAKE_EPOCH
+
+
+def is_snowflake(message_id):
+    return int(message_id) >= SNOWFLAKE_MIN_ID
+
+
+@functools.lru_cache(maxsize=64)
+def day_bounds(day: date):
+    """Returns the UTC epoch milliseconds `[start, end)` range of a day."""
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    start = int(start.timestamp() * 1000)
+    return start, start + DAY_MS
+
+
+def line_timestamp(line):
+    match = MESSAGE_ID.search(line)
+    if match and is_snowflake(match.group(1)):
+        return snowflake_timestamp(match.group(1))
+    try:
+        message_time = parse_timestamp(ujson.loads(line)["message_time"])
+    except (ValueError, KeyError, TypeError):
+        return None
+    return int(message_time.timestamp() * 1000)
+
+
+class DateIndex:
+    """Sidecar index mapping each calendar day (UTC) of a JSONL tweets file to
+    the byte ranges holding that day's tweets.
+
+    The day of a tweet is read from its snowflake `message_id`, falling back
+    to `message_time` for non-snowflake ids.  Lines without either stay with
+    the range they appear in.
+    """
+
+    suffix = ".idx"
+
+    def __init__(self, path, days=None, size=None, mtime=None):
+        self.path = path
+        self.days = days or {}
+        self.size = size
+        self.mtime = mtime
+
+    @classmethod
+    def sidecar(cls, path):
+        return f"{path}{cls.suffix}"
+
+    @classmethod
+    def build(cls, path):
+        if util.detect_compression(path):
+            raise ValueError(f"Can't index compressed file {path}")
+
+        stat = os.stat(path)
+        days = {}
+        current, start, pos = None, 0, 0
+        day_start = day_end = 0
+
+        with open(path, "rb") as fd:
+            for line in fd:
+                timestamp = line_timestamp(line)
+                if timestamp is not None and not day_start <= timestamp < day_end:
+                    day_start = timestamp - timestamp % DAY_MS
+                    day_end = day_start + DAY_MS
+                    day = datetime.fromtimestamp(day_start / 1000, tz=timezone.utc)
+                    day = day.date().isoformat()
+                    if current is None:
+                        current = day
+                    elif day != current:
+                        days.setdefault(current, []).append([start, pos])
+                        current, start = day, pos
+                pos += len(line)
+
+        if current is not None and pos > start:
+            days.setdefault(current, []).append([start, pos])
+
+        return cls(path, days=days, size=stat.st_size, mtime=stat.st_mtime_ns)
+
+    def save(self):
+        with open(self.sidecar(self.path), "w") as fd:
+            ujson.dump(dict(size=self.size, mtime=self.mtime, days=self.days), fd)
+        return self
+
+    @classmethod
+    def load(cls, path):
+        """Loads the sidecar index of `path`, or None if missing or stale."""
+        try:
+            with open(cls.sidecar(path)) as fd:
+                index = ujson.load(fd)
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return None
+
+        if (index.get("size"), index.get("mtime")) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return cls(path, days=index["days"], size=index["size"], mtime=index["mtime"])
+
+    def ranges(self, day: date):
+        """Returns the `(start, end)` byte ranges of a day's tweets."""
+        return [tuple(span) for span in self.days.get(day.isoformat(), [])]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.path}, days: {', '.join(self.days)})"
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
-from typing import Iterable
+from array import array
+from bisect import bisect_left
+from typing import Iterable, List, Sequence, Set, Tuple
 import collections
+import functools
+import itertools
 
-from . import util
+from . import storage, util
 from .tokenizers import NaiveTokenizer, NgramTokenizer
 
 
@@ -22,6 +26,38 @@ class Matcher:
     def build(self) -> Matcher:
         return self
 
+    def tokenize(self, text: str) -> Iterable[str]:
+        return self.tokenizer.tokenize(text)
+
+    def tokenize_many(self, texts: Sequence[str]) -> Iterable[Sequence[str]]:
+        return self.tokenizer.tokenize_many(texts)
+
+    def match_tokens(self, tokens: Iterable[str], results: Set[str]) -> None:
+        raise NotImplementedError
+
+    def query(self, text: str) -> Set[str]:
+        results = set()
+        self.match_tokens(self.tokenize(text), results)
+        return results
+
+    def query_many(self, texts: Sequence[str]) -> List[Tuple[int, str]]:
+        """Matches a batch of texts.
+
+        Returns a flat list of `(index, term)` pairs, where `index` is the
+        position of the text in `texts`, instead of a set per text.  Each
+        distinct text of the batch is only tokenized and matched once, so
+        repeated texts, e.g. retweets, cost a dict lookup.
+        """
+        found = dict.fromkeys(texts, ())
+        results = set()
+        match_tokens = self.match_tokens
+        for text, tokens in zip(found, self.tokenize_many(found)):
+            match_tokens(tokens, results)
+            if results:
+                found[text] = tuple(results)
+                results.clear()
+        return [(idx, term) for idx, text in enumerate(texts) for term in found[text]]
+
     def __repr__(self):
         return f"{type(self).__name__}(terms: {', '.join(self.terms)})"
 
@@ -46,9 +82,300 @@ class SetMatcher(Matcher):
     def contains(self, item):
         return item in self.terms
 
+    def contains_many(self, items: Iterable[str]) -> List[bool]:
+        terms = self.terms
+        return [item in terms for item in items]
+
     def __contains__(self, item):
         return self.contains(item)
 
+    def __iter__(self):
+        return iter(self.terms)
+
+    def save(self, path):
+        storage.save_sections(
+            path,
+            type(self).__name__,
+            dict(count=len(self.terms)),
+            dict(terms=storage.encode_strings(self.terms)),
+        )
+
+    @classmethod
+    def load(cls, path):
+        meta, sections = storage.load_sections(path, cls.__name__)
+        matcher = cls()
+        matcher.terms = set(storage.decode_strings(sections["terms"], meta["count"]))
+        return matcher
+
+    @classmethod
+    def union(cls, matchers: Iterable[SetMatcher]) -> SetMatcher:
+        return cls().add_terms(itertools.chain.from_iterable(matchers)).build()
+
+
+class IntSetMatcher(SetMatcher):
+    """Userset matcher for numeric node ids
+
+    Ids are stored as a sorted array of 64-bit integers instead of a set of
+    strings. A bloom filter of `bloom_bits` bits per id, probed with two
+    multiplicative hashes, rejects most non-members before the binary search.
+    Items that aren't integers are never members.
+
+    n = number of ids
+    q = number of items in a `contains_many` batch
+
+    Build:
+      Time: O(n log n)
+      Space: O(n), 8 bytes + bloom_bits / 8 per id
+
+    Query:
+      Time: O(1) for most non-members, O(log n) otherwise
+      Batch Time: O(q log q + q log n)
+    """
+
+    name = "Integer Set"
+    hash_factors = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F)
+    hash_shift = 40
+
+    def __init__(self, bloom_bits=10):
+        self.terms = []
+        self.bloom_bits = bloom_bits
+        self.ids = array("q")
+        self.bloom = bytearray()
+        self.mask = 0
+
+    def add_term(self, term):
+        self.terms.append(int(term))
+
+    def build(self):
+        self.ids = array("q", sorted(set(itertools.chain(self.ids, self.terms))))
+        self.terms = []
+
+        self.mask = 0
+        self.bloom = bytearray()
+        if self.bloom_bits and self.ids:
+            size = 8
+            while size < len(self.ids) * self.bloom_bits:
+                size <<= 1
+            self.mask = size - 1
+            self.bloom = bytearray(size // 8)
+            for item in self.ids:
+                for factor in self.hash_factors:
+                    bit = (item * factor) >> self.hash_shift & self.mask
+                    self.bloom[bit >> 3] |= 1 << (bit & 7)
+        return self
+
+    def maybe_contains(self, item):
+        mask, bloom, shift = self.mask, self.bloom, self.hash_shift
+        for factor in self.hash_factors:
+            bit = (item * factor) >> shift & mask
+            if not bloom[bit >> 3] >> (bit & 7) & 1:
+                return False
+        return True
+
+    def find(self, item):
+        """Returns the index of `item` in `ids`, -1 if it isn't a member."""
+        try:
+            item = int(item)
+        except (TypeError, ValueError):
+            return -1
+        if self.mask and not self.maybe_contains(item):
+            return -1
+        ids = self.ids
+        idx = bisect_left(ids, item)
+        return idx if idx < len(ids) and ids[idx] == item else -1
+
+    def find_many(self, items):
+        """Looks up a batch of items, probing the array once in sorted order.
+
+        Returns the integer key of every item, None if it isn't an integer,
+        and a dict of the keys found to their index in `ids`.
+        """
+        keys = []
+        for item in items:
+            try:
+                keys.append(int(item))
+            except (TypeError, ValueError):
+                keys.append(None)
+
+        candidates = {key for key in keys if key is not None}
+        if self.mask:
+            candidates = set(filter(self.maybe_contains, candidates))
+
+        ids = self.ids
+        found = {}
+        idx = 0
+        for key in sorted(candidates):
+            idx = bisect_left(ids, key, idx)
+            if idx < len(ids) and ids[idx] == key:
+                found[key] = idx
+        return keys, found
+
+    def contains(self, item):
+        return self.find(item) >= 0
+
+    def contains_many(self, items):
+        keys, found = self.find_many(items)
+        return [key in found for key in keys]
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def save(self, path):
+        meta = dict(bloom_bits=self.bloom_bits, mask=self.mask)
+        sections = dict(ids=self.ids, bloom=self.bloom)
+        storage.save_sections(path, type(self).__name__, meta, sections)
+
+    @classmethod
+    def load(cls, path):
+        meta, sections = storage.load_sections(path, cls.__name__)
+        matcher = cls(bloom_bits=meta["bloom_bits"])
+        matcher.ids = sections["ids"]
+        matcher.bloom = sections["bloom"]
+        matcher.mask = meta["mask"]
+        return matcher
+
+    def __repr__(self):
+        return f"{type(self).__name__}(ids: {len(self.ids)})"
+
+
+class UnitsMixin:
+    """Matcher of several units, each term carries a bitmask of its units"""
+
+    def add_terms(self, terms, unit=0):
+        for term in terms:
+            self.add_term(term, unit=unit)
+        return self
+
+    @classmethod
+    def from_txtfiles(cls, filepaths):
+        """Builds a matcher with the terms of each file as one unit."""
+        matcher = cls()
+        for unit, filepath in enumerate(filepaths):
+            matcher.add_terms(util.readlines(filepath), unit=unit)
+        matcher.build()
+        return matcher
+
+
+class UnitsSetMatcher(UnitsMixin, SetMatcher):
+    """Userset matcher for several units
+
+    Maps every node id to a bitmask of the units whose userset contains it,
+    so the units of a tweet's user are found with one lookup no matter how
+    many units there are.
+
+    n = number of distinct ids
+
+    Build:
+      Time: O(n)
+      Space: O(n)
+
+    Query:
+      Time: O(1)
+    """
+
+    name = "Units Set"
+
+    def __init__(self):
+        self.terms = {}
+
+    def add_term(self, term, unit=0):
+        self.terms[term] = self.terms.get(term, 0) | 1 << unit
+
+    def units(self, item):
+        """Returns the bitmask of the units `item` is in, 0 for none."""
+        return self.terms.get(item, 0)
+
+    def units_many(self, items):
+        get = self.terms.get
+        return [get(item, 0) for item in items]
+
+    def save(self, path):
+        storage.save_sections(
+            path,
+            type(self).__name__,
+            dict(count=len(self.terms)),
+            dict(
+                terms=storage.encode_strings(self.terms),
+                unit_masks=array("Q", self.terms.values()),
+            ),
+        )
+
+    @classmethod
+    def load(cls, path):
+        meta, sections = storage.load_sections(path, cls.__name__)
+        matcher = cls()
+        terms = storage.decode_strings(sections["terms"], meta["count"])
+        matcher.terms = dict(zip(terms, sections["unit_masks"]))
+        return matcher
+
+    def __repr__(self):
+        return f"{type(self).__name__}(ids: {len(self.terms)})"
+
+
+class UnitsIntSetMatcher(UnitsMixin, IntSetMatcher):
+    """Userset matcher for several units with numeric node ids
+
+    Like `IntSetMatcher`, with an array of 64-bit unit bitmasks alongside
+    the sorted ids, so at most 64 units.
+
+    n = number of distinct ids
+    q = number of items in a `units_many` batch
+
+    Build:
+      Time: O(n log n)
+      Space: O(n), 16 bytes + bloom_bits / 8 per id
+
+    Query:
+      Time: O(1) for most non-members, O(log n) otherwise
+      Batch Time: O(q log q + q log n)
+    """
+
+    name = "Units Integer Set"
+
+    def __init__(self, bloom_bits=10):
+        super().__init__(bloom_bits=bloom_bits)
+        self.term_units = {}
+        self.unit_masks = array("Q")
+
+    def add_term(self, term, unit=0):
+        term = int(term)
+        self.term_units[term] = self.term_units.get(term, 0) | 1 << unit
+
+    def build(self):
+        term_units = dict(zip(self.ids, self.unit_masks))
+        for term, mask in self.term_units.items():
+            term_units[term] = term_units.get(term, 0) | mask
+        self.term_units = {}
+        self.terms = list(term_units)
+        super().build()
+        self.unit_masks = array("Q", map(term_units.__getitem__, self.ids))
+        return self
+
+    def units(self, item):
+        """Returns the bitmask of the units `item` is in, 0 for none."""
+        idx = self.find(item)
+        return self.unit_masks[idx] if idx >= 0 else 0
+
+    def units_many(self, items):
+        keys, found = self.find_many(items)
+        unit_masks = self.unit_masks
+        return [unit_masks[found[key]] if key in found else 0 for key in keys]
+
+    def save(self, path):
+        meta = dict(bloom_bits=self.bloom_bits, mask=self.mask)
+        sections = dict(ids=self.ids, bloom=self.bloom, unit_masks=self.unit_masks)
+        storage.save_sections(path, type(self).__name__, meta, sections)
+
+    @classmethod
+    def load(cls, path):
+        meta, sections = storage.load_sections(path, cls.__name__)
+        matcher = cls(bloom_bits=meta["bloom_bits"])
+        matcher.ids = sections["ids"]
+        matcher.bloom = sections["bloom"]
+        matcher.unit_masks = sections["unit_masks"]
+        matcher.mask = meta["mask"]
+        return matcher
+
 
 class NaiveListMatcher(Matcher):
     """Term matcher implementation using a Naive List
@@ -70,15 +397,13 @@ class NaiveListMatcher(Matcher):
     name = "Naive List"
 
     def __init__(self, ngram_tokenizer=NgramTokenizer()):
-        self.ngram_tokenizer = ngram_tokenizer
+        self.tokenizer = self.ngram_tokenizer = ngram_tokenizer
         super().__init__()
 
-    def query(self, text):
-        results = set()
-        for ngram in self.ngram_tokenizer.tokenize(text):
+    def match_tokens(self, ngrams, results):
+        for ngram in ngrams:
             if ngram in self.terms:
                 results.add(ngram)
-        return results
 
 
 class NaiveSetMatcher(SetMatcher):
@@ -101,9 +426,12 @@ class NaiveSetMatcher(SetMatcher):
     name = "Naive Set"
 
     def __init__(self, ngram_tokenizer=NgramTokenizer()):
-        self.ngram_tokenizer = ngram_tokenizer
+        self.tokenizer = self.ngram_tokenizer = ngram_tokenizer
         super().__init__()
 
+    def match_tokens(self, ngrams, results):
+        results.update(self.terms.intersection(ngrams))
+
     def query(self, text):
         return set(self.ngram_tokenizer.tokenize(text)) & self.terms
 
@@ -111,6 +439,8 @@ class NaiveSetMatcher(SetMatcher):
 class TrieNode:
     """"Trie Node"""
 
+    __slots__ = ("value", "children", "terms")
+
     def __init__(self, value):
         self.value = value
         self.children = {}
@@ -123,9 +453,12 @@ class TrieNode:
 class ACNode(TrieNode):
     """Aho-Corasick Automaton Node"""
 
+    __slots__ = ("fail", "outputs")
+
     def __init__(self, value):
         super().__init__(value)
         self.fail = None
+        self.outputs = self.terms
 
 
 class TrieMatcher(Matcher):
@@ -160,9 +493,10 @@ class TrieMatcher(Matcher):
             node = node.children[word]
         node.terms.add(term)
 
-    def query(self, text):
-        results = set()
-        words = tuple(self.tokenizer.tokenize(text))
+    def tokenize(self, text):
+        return tuple(self.tokenizer.tokenize(text))
+
+    def match_tokens(self, words, results):
         node = self.root
 
         for idx, word in enumerate(words):
@@ -179,8 +513,6 @@ class TrieMatcher(Matcher):
                     idx += 1
                     word = words[idx]
 
-        return results
-
     def __repr__(self):
         return f"{type(self).__name__}(children: {', '.join(self.root.children)})"
 
@@ -191,15 +523,27 @@ class ACMatcher(TrieMatcher):
     Since matches exist only on word boundaries, each node only stores a
     complete word rather than a single character.
 
+    Built automata can be saved and loaded with their fail links, see
+    `save`. Terms can be added and removed after `build()`. A node's fail link only
+    depends on nodes ending in the same word, so `word_parents` indexes the
+    parents of every node, and their depth, by the word leading to it and an
+    update relinks only the nodes ending in the words it touched, in depth
+    order.  The index is built on the first update after `build()`, so
+    matchers that are never updated don't pay for it.
+
     n = number of terms
     m = number of nodes in automaton (roughly equal to total number of words in terms)
     w = number of words in query text (haystack)
     r = number of results returned
+    k = number of nodes ending in the words of an updated term
 
     Build:
       Time: O(n + m)
       Space: O(n + m)
 
+    Update:
+      Time: O(k log k) per batch of added or removed terms
+
     Query:
       Time: O(w) Best & Worst Case
       Space: O(r)
@@ -208,45 +552,645 @@ class ACMatcher(TrieMatcher):
     name = "Aho-Corasick"
     _node_factory = ACNode
 
-    def build(self):
-        super().build()
+    tokenize = Matcher.tokenize
 
+    def __init__(self, tokenizer=NaiveTokenizer()):
+        super().__init__(tokenizer)
         self.root.fail = self.root
+        self.word_parents = None
+        self.built = False
+
+    def insert(self, term):
+        """Adds `term` to the trie, returns the words of the nodes it changed."""
+        words = set()
+        node = self.root
+        for depth, word in enumerate(self.tokenizer.tokenize(term)):
+            child = node.children.get(word)
+            if child is None:
+                child = node.children[word] = self._node_factory(word)
+                if self.word_parents is not None:
+                    self.word_parents[word][node] = depth
+                words.add(word)
+            node = child
+        if node is not self.root and term not in node.terms:
+            node.terms.add(term)
+            words.add(node.value)
+        return words
+
+    def delete(self, term):
+        """Removes `term` and prunes its dead nodes, returns the words changed."""
+        path = [self.root]
+        for word in self.tokenizer.tokenize(term):
+            node = path[-1].children.get(word)
+            if node is None:
+                return set()
+            path.append(node)
+
+        node = path.pop()
+        if term not in node.terms:
+            return set()
+        node.terms.discard(term)
+        words = {node.value}
+        while path and not node.terms and not node.children:
+            parent = path.pop()
+            del parent.children[node.value]
+            if self.word_parents is not None:
+                parents = self.word_parents[node.value]
+                del parents[parent]
+                if not parents:
+                    del self.word_parents[node.value]
+            words.add(node.value)
+            node = parent
+        return words
+
+    def add_term(self, term):
+        self.add_terms([term])
+
+    def add_terms(self, terms):
+        if self.built and self.word_parents is None:
+            self.index_parents()
+        words = set().union(*map(self.insert, terms))
+        if self.built:
+            self.relink(words)
+        return self
+
+    def remove_term(self, term):
+        self.remove_terms([term])
+
+    def remove_terms(self, terms):
+        if self.built and self.word_parents is None:
+            self.index_parents()
+        words = set().union(*map(self.delete, terms))
+        if self.built:
+            self.relink(words)
+        return self
+
+    def link(self, parent, node):
+        word = node.value
+        fail = parent.fail
+        while fail is not self.root and word not in fail.children:
+            fail = fail.fail
+        fail = fail.children.get(word, self.root) if parent is not self.root else fail
+        node.fail = fail
+        self.link_outputs(node)
+
+    def link_outputs(self, node):
+        fail = node.fail
+        if not fail.outputs:
+            node.outputs = node.terms
+        elif not node.terms:
+            # Shared, any change to it relinks this node as well
+            node.outputs = fail.outputs
+        else:
+            node.outputs = node.terms | fail.outputs
+
+    def index_parents(self):
+        """Indexes the parents of every node and their depth by word."""
+        self.word_parents = collections.defaultdict(dict)
+        level, depth = [self.root], 0
+        while level:
+            for parent in level:
+                for word in parent.children:
+                    self.word_parents[word][parent] = depth
+            level = [child for node in level for child in node.children.values()]
+            depth += 1
+
+    def relink(self, words):
+        """Recomputes fail links and outputs of the nodes ending in `words`."""
+        edges = [
+            (depth, parent, word)
+            for word in words
+            for parent, depth in self.word_parents.get(word, {}).items()
+        ]
+        edges.sort(key=lambda edge: edge[0])
+        for _, parent, word in edges:
+            self.link(parent, parent.children[word])
+
+    def build(self):
+        queue = collections.deque([self.root])
+        while queue:
+            node = queue.popleft()
+            for child in node.children.values():
+                self.link(node, child)
+                queue.append(child)
 
-        queue = collections.deque()
-        for node in self.root.children.values():
-            node.fail = self.root
-            queue.append(node)
+        self.built = True
+        return self
 
+    def save(self, path):
+        """Saves the automaton in the `storage` binary format.
+
+        Nodes are stored in breadth-first order as the word leading to them,
+        their parent and their fail link, so loading skips tokenizing the
+        terms and searching for fail links.
+        """
+        if not self.built:
+            self.build()
+        vocab, index, terms = {}, {self.root: 0}, []
+        parents, words, fails, term_nodes = (array("i") for _ in range(4))
+        queue = collections.deque([self.root])
         while queue:
             node = queue.popleft()
             for word, child in node.children.items():
-                child.fail = (
-                    node.fail.children.get(word)
-                    or self.root.children.get(word)
-                    or self.root
-                )
-                if child.fail.terms:
-                    child.terms.update(child.fail.terms)
+                index[child] = len(index)
+                parents.append(index[node])
+                words.append(vocab.setdefault(word, len(vocab)))
                 queue.append(child)
+        for node, idx in index.items():
+            fails.append(index[node.fail])
+            terms.extend(node.terms)
+            term_nodes.extend([idx] * len(node.terms))
+        storage.save_sections(
+            path,
+            type(self).__name__,
+            dict(words=len(vocab), terms=len(terms)),
+            dict(
+                vocab=storage.encode_strings(vocab),
+                terms=storage.encode_strings(terms),
+                parents=parents,
+                words=words,
+                fails=fails,
+                term_nodes=term_nodes,
+            ),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Loads a saved automaton, its nodes are rebuilt with the garbage
+        collector paused."""
+        meta, sections = storage.load_sections(path, cls.__name__)
+        matcher = cls()
+        vocab = storage.decode_strings(sections["vocab"], meta["words"])
+        terms = storage.decode_strings(sections["terms"], meta["terms"])
+        nodes = [matcher.root]
+        node_factory = matcher._node_factory
+        with util.gc_paused():
+            for parent, word in zip(sections["parents"], sections["words"]):
+                node = node_factory(vocab[word])
+                nodes[parent].children[node.value] = node
+                nodes.append(node)
+            for term, idx in zip(terms, sections["term_nodes"]):
+                nodes[idx].terms.add(term)
+            # Fail links point to shallower nodes, whose outputs are set first
+            for node, fail in zip(nodes[1:], sections["fails"][1:]):
+                node.fail = nodes[fail]
+                matcher.link_outputs(node)
+        matcher.built = True
+        return matcher
+
+    def match_tokens(self, words, results):
+        root = self.root
+        node = root
+
+        for word in words:
+            while node is not root and word not in node.children:
+                node = node.fail
+            node = node.children.get(word, root)
+            if node.outputs:
+                results.update(node.outputs)
+
+
+class CompiledACMatcher(Matcher):
+    """Term matcher implementation using a compiled Aho-Corasick Automaton
+
+    On build, every word is interned to an integer id and the automaton is
+    stored as flat arrays instead of one node object per state:
 
+      root: transitions out of the root state, indexed by word id
+      delta: transitions out of every other state, keyed by
+        `state * vocab_size + word_id`
+      fail: fail link of each state
+      out_offsets/out_terms: output term ids of state `s` are
+        `out_terms[out_offsets[s]:out_offsets[s + 1]]`
+
+    Terms added after `build()` are only searchable after building again.
+
+    n = number of terms
+    m = number of states in automaton (roughly equal to total number of words in terms)
+    w = number of words in query text (haystack)
+    r = number of results returned
+
+    Build:
+      Time: O(n + m)
+      Space: O(n + m)
+
+    Query:
+      Time: O(w) Best & Worst Case
+      Space: O(r)
+    """
+
+    name = "Compiled Aho-Corasick"
+
+    def __init__(self, tokenizer=NaiveTokenizer()):
+        self.tokenizer = tokenizer
+        super().__init__()
+        self.compile([])
+
+    def build(self):
+        self.terms = list(dict.fromkeys(self.terms))
+        self.compile(self.terms)
         return self
 
-    def query(self, text):
-        results = set()
-        node = self.root
+    def build_automaton(self, terms):
+        """Builds the automaton of `terms` over interned word ids.
+
+        Returns the vocab, and the transitions, fail link and output term ids
+        of every state, state 0 being the root.
+        """
+        vocab = {}
+        children = [{}]
+        outputs = [[]]
+
+        for term_id, term in enumerate(terms):
+            state = 0
+            for word in self.tokenizer.tokenize(term):
+                word_id = vocab.setdefault(word, len(vocab))
+                child = children[state].get(word_id)
+                if child is None:
+                    child = len(children)
+                    children[state][word_id] = child
+                    children.append({})
+                    outputs.append([])
+                state = child
+            outputs[state].append(term_id)
+
+        fail = [0] * len(children)
+        queue = collections.deque(children[0].values())
+        while queue:
+            state = queue.popleft()
+            for word_id, child in children[state].items():
+                link = fail[state]
+                while link and word_id not in children[link]:
+                    link = fail[link]
+                fail[child] = children[link].get(word_id, 0) if state else 0
+                outputs[child].extend(outputs[fail[child]])
+                queue.append(child)
+        return vocab, children, fail, outputs
+
+    def compile(self, terms):
+        vocab, children, fail, outputs = self.build_automaton(terms)
+        width = len(vocab)
+        self.vocab = vocab
+        self.root = array("i", [0] * width)
+        for word_id, child in children[0].items():
+            self.root[word_id] = child
+        self.delta = {
+            state * width + word_id: child
+            for state, edges in enumerate(children[1:], start=1)
+            for word_id, child in edges.items()
+        }
+        self.fail = array("i", fail)
+        self.out_offsets = array("i", [0])
+        self.out_terms = array("i")
+        for term_ids in outputs:
+            self.out_terms.extend(term_ids)
+            self.out_offsets.append(len(self.out_terms))
+
+    def match_tokens(self, words, results):
+        term_ids = set()
+        self.match_term_ids(words, term_ids)
+        terms = self.terms
+        results.update([terms[term_id] for term_id in term_ids])
+
+    def match_term_ids(self, words, term_ids):
+        vocab, root, delta, fail = self.vocab, self.root, self.delta, self.fail
+        out_offsets, out_terms = self.out_offsets, self.out_terms
+        width = len(vocab)
+        state = 0
+
+        for word in words:
+            word_id = vocab.get(word)
+            if word_id is None:
+                state = 0
+                continue
+
+            while state:
+                child = delta.get(state * width + word_id)
+                if child is not None:
+                    state = child
+                    break
+                state = fail[state]
+            else:
+                state = root[word_id]
+
+            start, end = out_offsets[state], out_offsets[state + 1]
+            if start != end:
+                term_ids.update(out_terms[start:end])
+
+    def sections(self):
+        return dict(
+            vocab=storage.encode_strings(self.vocab),
+            terms=storage.encode_strings(self.terms),
+            root=array("i", self.root),
+            delta_keys=array("q", self.delta.keys()),
+            delta_values=array("i", self.delta.values()),
+            fail=array("i", self.fail),
+            out_offsets=array("i", self.out_offsets),
+            out_terms=array("i", self.out_terms),
+        )
+
+    def save(self, path):
+        """Saves the compiled automaton in the `storage` binary format."""
+        meta = dict(words=len(self.vocab), terms=len(self.terms))
+        storage.save_sections(path, type(self).__name__, meta, self.sections())
+
+    def restore(self, meta, sections):
+        words = storage.decode_strings(sections["vocab"], meta["words"])
+        self.vocab = dict(zip(words, range(len(words))))
+        self.terms = storage.decode_strings(sections["terms"], meta["terms"])
+        self.delta = dict(zip(sections["delta_keys"], sections["delta_values"]))
+        self.root = sections["root"]
+        self.fail = sections["fail"]
+        self.out_offsets = sections["out_offsets"]
+        self.out_terms = sections["out_terms"]
+
+    @classmethod
+    def load(cls, path):
+        """Loads a saved automaton, its arrays are memory-mapped from `path`."""
+        matcher = cls()
+        matcher.restore(*storage.load_sections(path, cls.__name__))
+        return matcher
+
+    def __repr__(self):
+        return f"{type(self).__name__}(states: {len(self.fail)}, words: {len(self.vocab)})"
+
+
+class DoubleArrayACMatcher(CompiledACMatcher):
+    """Term matcher implementation using a double-array Aho-Corasick Automaton
+
+    Like `CompiledACMatcher`, words are interned to integer ids, but the
+    transitions are stored as a double-array trie instead of a dict.  States
+    are positions in the arrays, and the child of state `s` on word id `w` is
+    `t = base[s] + w` if `check[t] == s`.  Bases are picked first-fit so the
+    children of all states interleave, leaving few positions unused:
+
+      base/check: transitions of each position
+      fail: fail link of each position
+      out_offsets/out_terms: output term ids of position `p` are
+        `out_terms[out_offsets[p]:out_offsets[p + 1]]`
+
+    Every position costs 16 bytes, against roughly 100 per transition for
+    the dict of `CompiledACMatcher`.
+
+    n = number of terms
+    m = number of states in automaton (roughly equal to total number of words in terms)
+    p = number of positions in the arrays, m plus the unused ones
+    v = number of distinct words in terms
+    w = number of words in query text (haystack)
+    r = number of results returned
+
+    Build:
+      Time: O(n + m * v) Worst Case, usually close to O(n + m)
+      Space: O(n + p)
+
+    Query:
+      Time: O(w) Best & Worst Case
+      Space: O(r)
+    """
+
+    name = "Double-Array Aho-Corasick"
+
+    def compile(self, terms):
+        vocab, children, fail, outputs = self.build_automaton(terms)
+        base = array("i", [0])
+        check = array("i", [0])
+        positions = [0] * len(children)
+
+        def is_free(position):
+            return position >= len(check) or check[position] < 0
+
+        next_free = 1
+        queue = collections.deque([0])
+        while queue:
+            state = queue.popleft()
+            edges = children[state]
+            if not edges:
+                continue
+            labels = sorted(edges)
+            position = max(next_free, labels[0])
+            while not (
+                is_free(position)
+                and all(is_free(position - labels[0] + label) for label in labels)
+            ):
+                position += 1
+
+            offset = position - labels[0]
+            size = offset + labels[-1] + 1
+            if size > len(check):
+                base.extend([0] * (size - len(base)))
+                check.extend([-1] * (size - len(check)))
+            base[positions[state]] = offset
+            for label in labels:
+                child = edges[label]
+                check[offset + label] = positions[state]
+                positions[child] = offset + label
+                queue.append(child)
+            while not is_free(next_free):
+                next_free += 1
+
+        size = len(check)
+        state_outputs = [()] * size
+        self.fail = array("i", [0] * size)
+        for state, position in enumerate(positions):
+            self.fail[position] = positions[fail[state]]
+            state_outputs[position] = outputs[state]
+        self.out_offsets = array("i", [0])
+        self.out_terms = array("i")
+        for term_ids in state_outputs:
+            self.out_terms.extend(term_ids)
+            self.out_offsets.append(len(self.out_terms))
+        self.vocab = vocab
+        self.base = base
+        self.check = check
+
+    def match_term_ids(self, words, term_ids):
+        vocab, base, check, fail = self.vocab, self.base, self.check, self.fail
+        out_offsets, out_terms = self.out_offsets, self.out_terms
+        size = len(check)
+        state = 0
+
+        for word in words:
+            word_id = vocab.get(word)
+            if word_id is None:
+                state = 0
+                continue
+
+            while True:
+                child = base[state] + word_id
+                if child < size and check[child] == state:
+                    state = child
+                    break
+                if not state:
+                    break
+                state = fail[state]
+
+            start, end = out_offsets[state], out_offsets[state + 1]
+            if start != end:
+                term_ids.update(out_terms[start:end])
+
+    def sections(self):
+        return dict(
+            vocab=storage.encode_strings(self.vocab),
+            terms=storage.encode_strings(self.terms),
+            base=array("i", self.base),
+            check=array("i", self.check),
+            fail=array("i", self.fail),
+            out_offsets=array("i", self.out_offsets),
+            out_terms=array("i", self.out_terms),
+        )
+
+    def restore(self, meta, sections):
+        words = storage.decode_strings(sections["vocab"], meta["words"])
+        self.vocab = dict(zip(words, range(len(words))))
+        self.terms = storage.decode_strings(sections["terms"], meta["terms"])
+        self.base = sections["base"]
+        self.check = sections["check"]
+        self.fail = sections["fail"]
+        self.out_offsets = sections["out_offsets"]
+        self.out_terms = sections["out_terms"]
+
+    def __repr__(self):
+        states = sum(1 for parent in self.check if parent >= 0)
+        return (
+            f"{type(self).__name__}(states: {states}, positions: {len(self.check)}, "
+            f"words: {len(self.vocab)})"
+        )
+
+
+class UnitsACMatcher(UnitsMixin, CompiledACMatcher):
+    """Term matcher for several units sharing one compiled Aho-Corasick Automaton
+
+    Every term carries a bitmask of the units whose termset contains it, so
+    a text is tokenized and scanned once no matter how many units it is
+    matched for.
+    """
 
-        for word in self.tokenizer.tokenize(text):
-            node = node.children.get(word) or node.fail.children.get(word) or self.root
-            results.update(node.terms)
+    name = "Units Aho-Corasick"
 
+    def __init__(self, tokenizer=NaiveTokenizer()):
+        self.term_units = {}
+        self.unit_masks = []
+        super().__init__(tokenizer=tokenizer)
+
+    def add_term(self, term, unit=0):
+        self.term_units[term] = self.term_units.get(term, 0) | 1 << unit
+
+    def build(self):
+        self.terms = list(self.term_units)
+        self.unit_masks = list(self.term_units.values())
+        self.compile(self.terms)
+        return self
+
+    def query_units(self, text, units=-1):
+        """Returns a `{term: unit mask}` dict of matches restricted to `units`."""
+        term_ids = set()
+        self.match_term_ids(self.tokenize(text), term_ids)
+
+        results = {}
+        terms, unit_masks = self.terms, self.unit_masks
+        for term_id in term_ids:
+            mask = unit_masks[term_id] & units
+            if mask:
+                results[terms[term_id]] = mask
         return results
 
+    def sections(self):
+        sections = super().sections()
+        sections["unit_masks"] = array("Q", self.unit_masks)
+        return sections
+
+    def restore(self, meta, sections):
+        super().restore(meta, sections)
+        self.unit_masks = sections["unit_masks"]
+        self.term_units = dict(zip(self.terms, self.unit_masks))
+
+
+class MemoMatcher:
+    """Caches the matches of the last `capacity` distinct texts of a matcher
+
+    Texts are normalized by the matcher's tokenizer, so texts with the same
+    tokens share an entry, and looked up in an LRU cache.  Cached matches
+    are shared between lookups and must not be modified.  Everything else
+    is delegated to the wrapped matcher.
+
+    c = capacity
+    t = length of a text
+
+    Space: O(c * t)
+    Query: O(t) on hits, plus the matcher's query on misses
+    """
+
+    def __init__(self, matcher, capacity=65536):
+        self.matcher = matcher
+        self.capacity = capacity
+        self.normalize = getattr(matcher.tokenizer, "normalize", str)
+        self.cached_query = functools.lru_cache(capacity)(matcher.query)
+        self.caches = [self.cached_query]
+        if hasattr(matcher, "query_units"):
+            self.cached_query_units = functools.lru_cache(capacity)(
+                matcher.query_units
+            )
+            self.caches.append(self.cached_query_units)
+        self.hits = self.misses = 0
+
+    def query(self, text):
+        return self.cached_query(self.normalize(text))
+
+    def query_many(self, texts):
+        query = self.query
+        return [(idx, term) for idx, text in enumerate(texts) for term in query(text)]
+
+    def query_units(self, text, units=-1):
+        matches = self.cached_query_units(self.normalize(text))
+        return {term: mask & units for term, mask in matches.items() if mask & units}
+
+    def cache_counts(self):
+        """Returns the number of cache hits and misses."""
+        hits, misses = self.hits, self.misses
+        for cache in self.caches:
+            info = cache.cache_info()
+            hits += info.hits
+            misses += info.misses
+        return hits, misses
+
+    def drain_counters(self):
+        hits, misses = self.cache_counts()
+        self.hits -= hits
+        self.misses -= misses
+        return hits, misses
+
+    def merge_counters(self, counters):
+        self.hits += counters[0]
+        self.misses += counters[1]
+
+    def __getattr__(self, name):
+        return getattr(self.matcher, name)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.matcher!r}, capacity={self.capacity})"
+
 
 termset_algos = {
     "naivelist": NaiveListMatcher,
     "naiveset": NaiveSetMatcher,
     "ahocorasick": ACMatcher,
+    "compiledahocorasick": CompiledACMatcher,
+    "doublearrayahocorasick": DoubleArrayACMatcher,
     "trie": TrieMatcher,
 }
-benchmark_algolist = [NaiveListMatcher, NaiveSetMatcher, TrieMatcher, ACMatcher]
+userset_algos = {
+    "set": SetMatcher,
+    "intset": IntSetMatcher,
+}
+units_userset_algos = {
+    "set": UnitsSetMatcher,
+    "intset": UnitsIntSetMatcher,
+}
+benchmark_algolist = [
+    NaiveListMatcher,
+    NaiveSetMatcher,
+    TrieMatcher,
+    ACMatcher,
+    CompiledACMatcher,
+    DoubleArrayACMatcher,
+]
@@ -1,11 +1,133 @@
 from collections import namedtuple
-import functools
+import itertools
+import multiprocessing
+import re
 
-from glide import Glider, Node, FileExtract, FormatPrint
+from glide import Glider, Node, PushNode, Return
 
-from . import db
+from . import db, sinks, util
+from .cache import MatcherCache
+from .dedup import RotatingBloomFilter
+from .index import DateIndex, day_bounds, is_snowflake, snowflake_timestamp
 from .schemas import Tweet
-from .matchers import SetMatcher, ACMatcher, termset_algos
+from .stats import PipelineStats
+from .matchers import (
+    SetMatcher,
+    ACMatcher,
+    UnitsACMatcher,
+    UnitsSetMatcher,
+    MemoMatcher,
+    termset_algos,
+    units_userset_algos,
+)
+
+
+# `message_time` dates results whose message_id isn't a snowflake, it isn't written
+MatchResult = namedtuple(
+    "MatchResult", ["term", "message_id", "unit", "message_time"], defaults=[None, None]
+)
+
+
+def unit_bits(units):
+    """Yields the positions of the set bits of a units bitmask, lowest first."""
+    while units:
+        low = units & -units
+        yield low.bit_length() - 1
+        units ^= low
+
+
+def maybe_in_range(message_id, start, end):
+    """Returns whether a message may be from the `[start, end)` epoch
+    milliseconds range, always for ids that aren't snowflakes."""
+    if not is_snowflake(message_id):
+        return True
+    return start <= snowflake_timestamp(message_id) < end
+
+
+class MappedExtract(Node):
+    """Extracts lines, or lists of lines per chunk with `push_chunks`, from a
+    path or `(path, start, end)` byte range of a memory-mapped file.
+
+    With `checkpoint`, it's called with the path and byte range of every
+    chunk once its lines went through the pipeline, or of the whole file
+    for compressed files.
+    """
+
+    def run(
+        self, shard, chunk_size=util.CHUNK_SIZE, push_chunks=False, checkpoint=None
+    ):
+        path, start, end = util.to_shard(shard)
+        if not (push_chunks or checkpoint):
+            for line in util.read_lines(path, start, end, chunk_size):
+                self.push(line)
+            return
+
+        compressed = util.detect_compression(path)
+        pos = start
+        for chunk in util.read_chunks(path, start, end, chunk_size):
+            lines = list(filter(None, chunk.decode().split("\n")))
+            if push_chunks:
+                self.push(lines)
+            else:
+                for line in lines:
+                    self.push(line)
+            if checkpoint and not compressed:
+                checkpoint(path, pos, pos + len(chunk))
+            pos += len(chunk)
+        if checkpoint and compressed:
+            checkpoint(path, start, end)
+
+
+class StreamExtract(Node):
+    """Extracts the lines, or with `push_batches` the lists of lines, of
+    micro-batches read from a stream."""
+
+    def run(self, batch, push_batches=False):
+        if push_batches:
+            self.push(batch)
+            return
+        for line in batch:
+            self.push(line)
+
+
+class PreFilter(Node):
+    """Drops raw lines before they are decoded.
+
+    Lines are dropped when their `node_id` is not in `nodes` (the union of
+    all usersets), or when `execution_date` is set and the timestamp of their
+    snowflake `message_id` is on another day.  Lines the fields can't be
+    read from, or with older ids, are passed through.
+    """
+
+    node_id = re.compile(r'"node_id"\s*:\s*"?([^",}\s]+)')
+    message_id = re.compile(r'"message_id"\s*:\s*"?(\d+)')
+
+    def run(self, data, nodes=None, execution_date=None):
+        if nodes is not None:
+            match = self.node_id.search(data)
+            if match and match.group(1) not in nodes:
+                return
+
+        if execution_date:
+            match = self.message_id.search(data)
+            bounds = day_bounds(execution_date)
+            if match and not maybe_in_range(match.group(1), *bounds):
+                return
+
+        self.push(data)
+
+
+class Dedup(Node):
+    """Drops raw lines of messages whose `message_id` was seen before.
+
+    Lines the `message_id` can't be read from are passed through.
+    """
+
+    def run(self, data, seen: RotatingBloomFilter):
+        match = PreFilter.message_id.search(data)
+        if match and seen.add(int(match.group(1))):
+            return
+        self.push(data)
 
 
 class SchemaLoad(Node):
@@ -29,22 +151,225 @@ class UserFilter(Node):
 
 
 class TermFilter(Node):
-    MatchResult = namedtuple("MatchResult", ["term", "message_id"])
+    MatchResult = MatchResult
 
-    def run(self, data, termset: ACMatcher):
+    def run(self, data, termset: ACMatcher, unit=None):
+        message_id, message_time = data.message_id, data.message_time
         for match in termset.query(data.text):
-            result = self.MatchResult(match.lower(), data.message_id)
+            result = self.MatchResult(match.lower(), message_id, unit, message_time)
             self.push(result)
 
 
+class UnitsTermFilter(TermFilter):
+    """Matches tweets against the termsets of the units their user is in.
+
+    The units are found with one lookup of the node id in `userset`, so
+    tweets only go through the termsets of their units.
+    """
+
+    def run(self, data, userset: UnitsSetMatcher, termsets):
+        MatchResult = self.MatchResult
+        message_id, message_time = data.message_id, data.message_time
+        for unit in unit_bits(userset.units(data.node_id)):
+            for match in termsets[unit].query(data.text):
+                result = MatchResult(match.lower(), message_id, unit + 1, message_time)
+                self.push(result)
+
+
+class UnitsFilter(Node):
+    def run(self, data, userset: UnitsSetMatcher, termset: UnitsACMatcher):
+        units = userset.units(data.node_id)
+        if not units:
+            return
+
+        matches = termset.query_units(data.text, units)
+        message_id, message_time = data.message_id, data.message_time
+        for unit in unit_bits(units):
+            for match, mask in matches.items():
+                if mask >> unit & 1:
+                    result = MatchResult(
+                        match.lower(), message_id, unit + 1, message_time
+                    )
+                    self.push(result)
+
+
 class SALoader(Node):
     def run(self, data, db_session, db_model):
-        obj = db_model(**data._asdict())
+        obj = db_model(term=data.term, message_id=data.message_id)
         db_session.add(obj)
         results = db_session.commit()
         self.push(results)
 
 
+class BulkSALoader(Node):
+    def run(self, data, db_writer: db.BulkWriter):
+        db_writer.add(data)
+        self.push(data)
+
+    def end(self):
+        self.context["db_writer"].flush()
+
+
+class SinkLoad(Node):
+    def run(self, data, sink: sinks.Sink):
+        sink.write(data)
+        self.push(data)
+
+    def end(self):
+        self.context["sink"].close()
+
+
+class BatchPreFilter(PreFilter):
+    def run(self, data, nodes=None, execution_date=None):
+        if nodes is not None:
+            matches = list(map(self.node_id.search, data))
+            found = nodes.contains_many(
+                [match.group(1) if match else None for match in matches]
+            )
+            data = [
+                line
+                for line, match, keep in zip(data, matches, found)
+                if keep or not match
+            ]
+
+        if execution_date:
+            start, end = day_bounds(execution_date)
+            data = [
+                line
+                for line, match in zip(data, map(self.message_id.search, data))
+                if not match or maybe_in_range(match.group(1), start, end)
+            ]
+
+        if data:
+            self.push(data)
+
+
+class BatchDedup(Dedup):
+    def run(self, data, seen: RotatingBloomFilter):
+        search, add = PreFilter.message_id.search, seen.add
+        data = [
+            line
+            for line, match in zip(data, map(search, data))
+            if not (match and add(int(match.group(1))))
+        ]
+        if data:
+            self.push(data)
+
+
+class BatchSchemaLoad(SchemaLoad):
+    def run(self, data, schema: Tweet):
+        self.push(list(map(schema.parse_raw, data)))
+
+
+class BatchDateFilter(DateFilter):
+    def run(self, data, execution_date=None):
+        if execution_date:
+            data = [
+                tweet for tweet in data if tweet.message_time.date() == execution_date
+            ]
+        if data:
+            self.push(data)
+
+
+class BatchUserFilter(UserFilter):
+    def run(self, data, userset: SetMatcher):
+        found = userset.contains_many([tweet.node_id for tweet in data])
+        data = [tweet for tweet, keep in zip(data, found) if keep]
+        if data:
+            self.push(data)
+
+
+class BatchTermFilter(TermFilter):
+    def run(self, data, termset: ACMatcher, unit=None):
+        MatchResult = self.MatchResult
+        matches = termset.query_many([tweet.text for tweet in data])
+        results = [
+            MatchResult(
+                match.lower(), data[idx].message_id, unit, data[idx].message_time
+            )
+            for idx, match in matches
+        ]
+        if results:
+            self.push(results)
+
+
+class BatchUnitsTermFilter(UnitsTermFilter):
+    def run(self, data, userset: UnitsSetMatcher, termsets):
+        members = [[] for _ in termsets]
+        for pos, units in enumerate(userset.units_many([t.node_id for t in data])):
+            for unit in unit_bits(units):
+                members[unit].append(pos)
+
+        # Matches are collected per tweet so they come out in input order,
+        # as they do per record.
+        MatchResult = self.MatchResult
+        per_tweet = [[] for _ in data]
+        for unit, (termset, positions) in enumerate(zip(termsets, members), start=1):
+            if not positions:
+                continue
+            matches = termset.query_many([data[pos].text for pos in positions])
+            for idx, match in matches:
+                pos = positions[idx]
+                tweet = data[pos]
+                per_tweet[pos].append(
+                    MatchResult(
+                        match.lower(), tweet.message_id, unit, tweet.message_time
+                    )
+                )
+        results = [result for results in per_tweet for result in results]
+        if results:
+            self.push(results)
+
+
+class BatchUnitsFilter(UnitsFilter):
+    def run(self, data, userset: UnitsSetMatcher, termset: UnitsACMatcher):
+        results = []
+        for tweet, units in zip(data, userset.units_many([t.node_id for t in data])):
+            if not units:
+                continue
+            matches = termset.query_units(tweet.text, units)
+            for unit in unit_bits(units):
+                for match, mask in matches.items():
+                    if mask >> unit & 1:
+                        results.append(
+                            MatchResult(
+                                match.lower(),
+                                tweet.message_id,
+                                unit + 1,
+                                tweet.message_time,
+                            )
+                        )
+        if results:
+            self.push(results)
+
+
+class BatchBulkSALoader(BulkSALoader):
+    def run(self, data, db_writer: db.BulkWriter):
+        for result in data:
+            db_writer.add(result)
+        self.push(data)
+
+
+class BatchSinkLoad(SinkLoad):
+    def run(self, data, sink: sinks.Sink):
+        sink.write_many(data)
+        self.push(data)
+
+
+batch_nodes = {
+    PreFilter: BatchPreFilter,
+    Dedup: BatchDedup,
+    SchemaLoad: BatchSchemaLoad,
+    DateFilter: BatchDateFilter,
+    UserFilter: BatchUserFilter,
+    TermFilter: BatchTermFilter,
+    UnitsTermFilter: BatchUnitsTermFilter,
+    UnitsFilter: BatchUnitsFilter,
+    BulkSALoader: BatchBulkSALoader,
+    SinkLoad: BatchSinkLoad,
+}
+
+
 class PipelineBuilder:
     default_units = (
         dict(userset="data/nodes1.txt", termset="data/terms1.txt"),
@@ -55,68 +380,404 @@ class PipelineBuilder:
         self,
         schema=Tweet,
         db_uri="sqlite:///:memory:",
-        db_model=db.Results,
+        db_model=None,
         units=default_units,
+        merge_units=False,
+        db_load=False,
+        db_batch_size=1000,
+        db_schema="simple",
+        db_pragmas=None,
+        cache_dir=None,
+        stats=None,
+        output_format="text",
+        output=None,
+        partition_by=None,
+        checkpoint=None,
+        dedup=None,
+        match_cache_size=0,
+        batch=False,
+        chunk_size=util.CHUNK_SIZE,
     ):
         self.schema = schema
-        self.db = db.DataAccessLayer(db_uri).connect()
+        self.db = db.DataAccessLayer(db_uri, sqlite_pragmas=db_pragmas).connect()
         self.db_model = db_model
         self.units = units
+        self.merge_units = merge_units
+        self.db_load = db_load
+        self.db_writer = db.writers[db_schema](
+            self.db.engine, model=db_model, batch_size=db_batch_size
+        )
+        self.execution_date = None
+        self.cache = MatcherCache(cache_dir)
+        self.stats = stats
+        self.output_format = output_format
+        self.output = output
+        self.partition_by = partition_by
+        self.checkpoint = checkpoint
+        self.dedup = dedup
+        self.dedup_bytes = dedup.max_bytes if dedup else None
+        self.match_cache_size = match_cache_size
+        self.batch = batch
+        self.chunk_size = chunk_size
+        if checkpoint and output_format == "parquet":
+            raise ValueError("Parquet output can't be checkpointed")
+        if len(units) > util.MAX_UNITS:
+            raise ValueError(f"At most {util.MAX_UNITS} units are allowed")
 
-    @staticmethod
-    def format_result(r, template):
-        return template.format(r=r)
+    def node(self, cls, name, **kwargs):
+        """Builds a node, its batch version when building for batches."""
+        if self.batch:
+            cls = batch_nodes[cls]
+        return cls(name, **kwargs)
+
+    def build_extract(self, stream=False):
+        if stream:
+            return StreamExtract("extract", push_batches=self.batch)
+        return MappedExtract(
+            "extract", chunk_size=self.chunk_size, push_chunks=self.batch
+        )
 
     def build_units(self):
-        def build_unit(idx):
-            return UserFilter(f"nodes{idx}") | TermFilter(f"terms{idx}")
+        if self.merge_units:
+            return self.node(UnitsFilter, "units")
+        return self.node(UnitsTermFilter, "units")
+
+    def build_stages(self):
+        node = self.node
+        stages = node(PreFilter, "prefilter")
+        if self.dedup:
+            stages = stages | node(Dedup, "dedup")
+        return (
+            stages
+            | node(SchemaLoad, "schema", schema=self.schema)
+            | node(DateFilter, "date_filter")
+            | self.build_units()
+        )
 
-        return [build_unit(idx) for idx, _ in enumerate(self.units, start=1)]
+    def build_outputs(self):
+        outputs = [self.node(SinkLoad, "output")]
+        if self.db_load:
+            outputs.append(self.node(BulkSALoader, "sql_load"))
+        return outputs
 
-    # SALoader("sql_load", db_model=self.db_model)
-    def build(self):
+    def build(self, stream=False):
+        """Builds the pipeline, pushing records one at a time through its
+        nodes, or lists of them with `batch`."""
         self.pipeline = Glider(
-            FileExtract("extract", push_lines=True)
-            | SchemaLoad("schema", schema=self.schema)
-            | DateFilter("date_filter")
-            | self.build_units()
-            | [FormatPrint("print")],
+            self.build_extract(stream)
+            | self.build_stages()
+            | self.build_outputs(),
             global_state={"db_session": self.db.Session()},
         )
+        if self.stats:
+            self.stats.instrument(self.pipeline)
         return self
 
+    def build_shards(self):
+        """Builds the pipelines for sharded runs.
+
+        Workers run the stages over a shard and return its results, which are
+        then pushed through the outputs of the merge pipeline.
+        """
+        worker = Glider(
+            self.build_extract() | self.build_stages() | [Return("collect")]
+        )
+        merger = Glider(
+            PushNode("merge") | self.build_outputs(),
+            global_state={"db_session": self.db.Session()},
+        )
+        if self.stats:
+            self.stats.instrument(merger)
+        return worker, merger
+
     def set_context(
         self,
         termset_algo="AhoCorasick",
         format_template="{r.term}, {r.message_id}",
         execution_date=None,
+        userset_algo="Set",
     ):
         TermsetMatcher = termset_algos[termset_algo.lower()]
+        UsersetMatcher = units_userset_algos[userset_algo.lower()]
         if execution_date:
             execution_date = execution_date.date()
+        self.execution_date = execution_date
 
+        userset = self.cache.from_txtfiles(
+            UsersetMatcher, [unit["userset"] for unit in self.units]
+        )
         self.context = {
+            "prefilter": {
+                "nodes": userset,
+                "execution_date": execution_date,
+            },
+            "dedup": {"seen": self.dedup},
             "date_filter": {"execution_date": execution_date},
-            "print": {
-                "format_func": functools.partial(
-                    self.format_result, template=format_template
+            "sql_load": {"db_writer": self.db_writer},
+            "output": {
+                "sink": sinks.open_sink(
+                    self.output_format,
+                    self.output,
+                    template=format_template,
+                    partition_by=self.partition_by,
                 )
             },
         }
-        for idx, unit in enumerate(self.units, start=1):
-            nodes_key = f"nodes{idx}"
-            self.context[nodes_key] = dict(
-                userset=SetMatcher.from_txtfile(unit["userset"])
-            )
-            terms_key = f"terms{idx}"
-            self.context[terms_key] = dict(
-                termset=TermsetMatcher.from_txtfile(unit["termset"])
+        if self.merge_units:
+            self.context["units"] = dict(
+                userset=userset,
+                termset=self.memoize(
+                    self.cache.from_txtfiles(
+                        UnitsACMatcher, [unit["termset"] for unit in self.units]
+                    )
+                ),
             )
+            return self
 
+        self.context["units"] = dict(
+            userset=userset,
+            termsets=[
+                self.memoize(self.cache.from_txtfile(TermsetMatcher, unit["termset"]))
+                for unit in self.units
+            ],
+        )
         return self
 
-    def run(self, data):
-        self.pipeline.consume(data, **self.context)
+    def memoize(self, termset):
+        if not self.match_cache_size:
+            return termset
+        return MemoMatcher(termset, capacity=self.match_cache_size)
+
+    def match_caches(self):
+        """Maps termset names, `units` when merged, to their match caches."""
+        units = self.context["units"]
+        if self.merge_units:
+            termsets = {"units": units["termset"]}
+        else:
+            termsets = {
+                f"terms{idx}": termset
+                for idx, termset in enumerate(units["termsets"], start=1)
+            }
+        return {
+            name: termset
+            for name, termset in termsets.items()
+            if isinstance(termset, MemoMatcher)
+        }
+
+    def node_context(self, pipeline):
+        nodes = pipeline.get_node_lookup()
+        return {name: ctx for name, ctx in self.context.items() if name in nodes}
+
+    def plan(self, data):
+        """Maps data files to the `(path, start, end)` byte ranges to read.
+
+        When running for an execution date, files with a date index sidecar
+        are narrowed down to the ranges holding that day's tweets.
+        """
+        shards = []
+        for path in data:
+            index = self.execution_date and DateIndex.load(path)
+            if index:
+                ranges = index.ranges(self.execution_date)
+                shards.extend((path, start, end) for start, end in ranges)
+            else:
+                shards.append((path, 0, None))
+        return shards
+
+    def share_dedup(self, workers):
+        """Splits the dedup memory between the parent and every worker.
+
+        Workers drop the duplicates within their shards with their own
+        filter, the parent those across shards.  Sizes that change replace
+        the parent's filter with an empty one.
+        """
+        max_bytes = self.dedup_bytes // (workers + 1 if workers > 1 else 1)
+        if self.dedup.max_bytes != max_bytes:
+            self.dedup = self.dedup.resized(max_bytes)
+            self.context["dedup"]["seen"] = self.dedup
+
+    def run(self, data, workers=1, ordered=False, resume=False):
+        shards = self.plan(data)
+        if self.dedup:
+            self.share_dedup(workers)
+        if self.checkpoint:
+            shards = self.start_checkpoint(shards, resume=resume)
+        if self.stats:
+            self.stats.start()
+        try:
+            if workers > 1:
+                self.run_sharded(shards, workers=workers, ordered=ordered)
+            else:
+                context = self.node_context(self.pipeline)
+                if self.checkpoint:
+                    context["extract"] = dict(
+                        context.get("extract", {}), checkpoint=self.checkpoint_range
+                    )
+                self.pipeline.consume(shards, **context)
+        finally:
+            if self.stats:
+                self.stats.stop()
+        if self.checkpoint:
+            self.save_checkpoint()
+
+    def start_checkpoint(self, shards, resume=False):
+        """Returns the shards left to process.
+
+        When resuming from a saved checkpoint, the outputs are rolled back to
+        it, the dedup filter is restored and only the ranges it hasn't
+        recorded are left.
+        """
+        if not (resume and self.checkpoint.load()):
+            return shards
+        self.context["output"]["sink"].restore(self.checkpoint.outputs)
+        if self.db_load and self.checkpoint.db is not None:
+            self.db_writer.restore(self.checkpoint.db)
+        if self.dedup and self.checkpoint.dedup:
+            self.dedup.restore(self.checkpoint.dedup)
+        return list(self.checkpoint.remaining(shards))
+
+    def checkpoint_range(self, path, start, end):
+        self.checkpoint.mark(path, start, end)
+        if self.checkpoint.due:
+            self.save_checkpoint()
+
+    def save_checkpoint(self):
+        outputs = self.context["output"]["sink"].positions()
+        db_position = self.db_writer.position() if self.db_load else None
+        self.checkpoint.save(outputs, db=db_position, dedup=self.dedup)
+
+    def run_stream(self, fd, batch_size=1000, queue_size=16):
+        """Runs the pipeline, built with `stream`, over lines read from `fd`
+        until it ends.
+
+        Lines are processed in micro-batches and the outputs are flushed
+        after each batch.  See `util.read_stream` for how batches are formed
+        and bounded.
+        """
+        batches = util.read_stream(fd, batch_size=batch_size, queue_size=queue_size)
+        if self.stats:
+            self.stats.start()
+        try:
+            self.pipeline.consume(
+                self.flush_batches(batches), **self.node_context(self.pipeline)
+            )
+        finally:
+            if self.stats:
+                self.stats.stop()
+
+    def flush_batches(self, batches):
+        # Glide pushes each batch through the whole pipeline before asking
+        # for the next one
+        for batch in batches:
+            yield batch
+            self.flush_outputs()
+
+    def flush_outputs(self):
+        self.context["output"]["sink"].flush()
+        if self.db_load:
+            self.db_writer.flush()
+
+    def run_sharded(self, data, workers, ordered=False):
+        """Runs the stages over byte range shards of `data` in a process pool.
+
+        Matchers are built once in the parent and inherited by forked workers.
+        With `ordered`, results are merged in input order.  With stats, the
+        counters of the worker nodes are sent back with each shard's results,
+        as are the counters of the context values, see `drain_counters`.
+        With a checkpoint, shards are recorded once their results are merged.
+        With dedup, results of messages seen in earlier shards are dropped,
+        see `share_dedup`.
+        With `batch`, the results of each shard are merged as one batch.
+        """
+        worker, merger = self.build_shards()
+        shards = util.split_files(data, workers)
+        context = self.node_context(worker)
+        if self.dedup:
+            context["dedup"] = dict(seen=self.dedup.resized(self.dedup.max_bytes))
+
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with mp_context.Pool(
+            workers,
+            initializer=_init_shard_worker,
+            initargs=(
+                worker,
+                context,
+                bool(self.stats),
+                self.batch,
+            ),
+        ) as pool:
+            imap = pool.imap if ordered else pool.imap_unordered
+            results = self.merge_shards(imap(_consume_shard, shards))
+            if not self.batch:
+                results = itertools.chain.from_iterable(results)
+            merger.consume(results, **self.node_context(merger))
+
+    def merge_shards(self, shard_results):
+        for shard, results, counters, context_counters in shard_results:
+            if counters:
+                self.stats.merge(counters)
+            for (name, arg, idx), values in context_counters.items():
+                value = self.context[name][arg]
+                if isinstance(value, list):
+                    value = value[idx]
+                value.merge_counters(values)
+            if self.dedup:
+                results = self.dedup_results(results)
+            yield results
+            # The results of the shard went through the merger
+            if self.checkpoint:
+                self.checkpoint_range(*shard)
+
+    def dedup_results(self, results):
+        """Drops the results of messages already merged from other shards.
+
+        Workers only drop the duplicates within their own shards.
+        """
+        kept, new, dropped = [], set(), set()
+        for result in results:
+            message_id = result.message_id
+            if message_id in dropped:
+                continue
+            if message_id not in new:
+                if self.dedup.add(int(message_id)):
+                    dropped.add(message_id)
+                    continue
+                new.add(message_id)
+            kept.append(result)
+        return kept
 
     def plot(self, filepath="pipeline.png"):
         self.pipeline.plot(filepath)
+
+
+_shard_worker = None
+
+
+def _init_shard_worker(pipeline, context, stats=False, batch=False):
+    global _shard_worker
+    if stats:
+        stats = PipelineStats()
+        stats.instrument(pipeline)
+    _shard_worker = (pipeline, context, stats, batch)
+
+
+def _consume_shard(shard):
+    pipeline, context, stats, batch = _shard_worker
+    results = pipeline.consume([shard], **context) or []
+    if batch:
+        results = list(itertools.chain.from_iterable(results))
+    return shard, results, stats.drain() if stats else None, drain_counters(context)
+
+
+def drain_counters(context):
+    """Drains the counters of the context values that keep any, like the
+    duplicates skipped by dedup, by node name, argument and position within
+    list arguments."""
+    return {
+        (name, arg, idx): value.drain_counters()
+        for name, node_context in context.items()
+        for arg, values in node_context.items()
+        for idx, value in enumerate(values if isinstance(values, list) else [values])
+        if hasattr(value, "drain_counters")
+    }
@@ -1,8 +1,41 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import functools
 
 import ujson
 from pydantic import BaseModel, validator
 
+TIMESTAMP_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+MONTHS = {
+    month: idx
+    for idx, month in enumerate(
+        "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), start=1
+    )
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_timestamp(value):
+    """Parses a Twitter timestamp, e.g. `Mon Apr 08 19:45:35 +0000 2019`.
+
+    Fixed-width timestamps are sliced directly, anything else falls back to
+    `strptime`.  Results are cached since tweets share timestamps.
+    """
+    if len(value) != 30 or value[20] not in "+-":
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+    try:
+        offset = timedelta(hours=int(value[21:23]), minutes=int(value[23:25]))
+        return datetime(
+            int(value[26:30]),
+            MONTHS[value[4:7]],
+            int(value[8:10]),
+            int(value[11:13]),
+            int(value[14:16]),
+            int(value[17:19]),
+            tzinfo=timezone(-offset if value[20] == "-" else offset),
+        )
+    except (KeyError, ValueError):
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
 
 class Tweet(BaseModel):
     class Config:
@@ -23,4 +56,48 @@ class Tweet(BaseModel):
 
     @validator("message_time", pre=True)
     def parse_timestamp(cls, v):
-        return datetime.strptime(v, "%a %b %d %H:%M:%S %z %Y")
+        return parse_timestamp(v)
+
+
+class FastTweet:
+    """Lightweight tweet record decoded without pydantic validation
+
+    Only checks that the required fields are present, `message_time` is
+    parsed on first access.
+    """
+
+    __slots__ = ("text", "node_id", "message_id", "_message_time")
+
+    def __init__(self, text, node_id, message_id, message_time):
+        self.text = text
+        self.node_id = node_id
+        self.message_id = message_id
+        self._message_time = message_time
+
+    @property
+    def message_time(self):
+        if isinstance(self._message_time, str):
+            self._message_time = parse_timestamp(self._message_time)
+        return self._message_time
+
+    @classmethod
+    def parse_raw(cls, raw):
+        data = ujson.loads(raw)
+        try:
+            return cls(
+                data["text"],
+                str(data["node_id"]),
+                str(data["message_id"]),
+                data["message_time"],
+            )
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"Invalid tweet, missing field: {exc}") from exc
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(node_id={self.node_id!r}, "
+            f"message_id={self.message_id!r}, text={self.text!r})"
+        )
+
+
+decoders = {"strict": Tweet, "fast": FastTweet}
@@ -0,0 +1,304 @@
+from datetime import date, timedelta, timezone
+from operator import attrgetter
+import csv
+import functools
+import os
+import string
+import sys
+
+import ujson
+
+from .index import DAY_MS, is_snowflake, snowflake_timestamp
+
+FIELDS = ("term", "message_id", "unit")
+
+
+def compile_template(template):
+    """Compiles a `str.format` template of a result `r` into a function.
+
+    Fields like `{r.term}` are resolved with one `attrgetter` and, without
+    format specs or conversions, interpolated with `%`. Templates with other
+    fields fall back to `str.format`.
+    """
+    parts, percent_parts, names = [], [], []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        if percent_parts is not None:
+            percent_parts.append(literal.replace("%", "%%"))
+        if field is None:
+            continue
+        if not field.startswith("r.") or "[" in field or "{" in spec:
+            return lambda r: template.format(r=r)
+        names.append(field[2:])
+        if spec or conversion:
+            percent_parts = None
+        elif percent_parts is not None:
+            percent_parts.append("%s")
+        conversion = f"!{conversion}" if conversion else ""
+        spec = f":{spec}" if spec else ""
+        parts.append(f"{{{conversion}{spec}}}")
+
+    if not names:
+        text = "".join(parts).format()
+        return lambda r: text
+    getter = attrgetter(*names)
+    if percent_parts is not None:
+        fmt = "".join(percent_parts)
+        if len(names) == 1:
+            return lambda r: fmt % (getter(r),)
+        return lambda r: fmt % getter(r)
+    fmt = "".join(parts)
+    if len(names) == 1:
+        return lambda r: fmt.format(getter(r))
+    return lambda r: fmt.format(*getter(r))
+
+
+@functools.lru_cache(maxsize=64)
+def epoch_day(day):
+    return (date(1970, 1, 1) + timedelta(days=day)).isoformat()
+
+
+def result_day(result):
+    """Returns the UTC day of a result's message, from its snowflake id or
+    else its `message_time`."""
+    if result.message_time is None or is_snowflake(result.message_id):
+        return epoch_day(snowflake_timestamp(result.message_id) // DAY_MS)
+    return result.message_time.astimezone(timezone.utc).date().isoformat()
+
+
+class Sink:
+    """Buffers results and writes them in blocks of `buffer_rows` rows.
+
+    Writes to `path`, or stdout without one. The file is opened on the first
+    block and closed, after writing what's left, by `close`. `flush` writes
+    what's buffered without waiting for a full block.
+    """
+
+    extension = ""
+
+    def __init__(self, path=None, template=None, buffer_rows=8192):
+        self.path = path
+        self.template = template
+        self.buffer_rows = buffer_rows
+        self.rows = []
+        self.fd = None
+        self.mode = "w"
+
+    def open(self):
+        if self.path is None:
+            return sys.stdout
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return open(self.path, self.mode, newline="")
+
+    def positions(self):
+        """Maps the absolute output path to the bytes written to it, after
+        flushing."""
+        if self.path is None:
+            return {}
+        self.flush()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {os.path.abspath(self.path): size}
+
+    def restore(self, positions):
+        """Truncates the output back to its recorded size and appends to it."""
+        key = os.path.abspath(self.path) if self.path is not None else None
+        if key not in positions:
+            return
+        if os.path.exists(self.path):
+            os.truncate(self.path, positions[key])
+        self.mode = "a"
+
+    def begin(self):
+        pass
+
+    def write(self, result):
+        self.rows.append(result)
+        if len(self.rows) >= self.buffer_rows:
+            self.flush()
+
+    def write_many(self, results):
+        self.rows.extend(results)
+        if len(self.rows) >= self.buffer_rows:
+            self.flush()
+
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def flush(self):
+        if self.rows:
+            if self.fd is None:
+                self.fd = self.open()
+                self.begin()
+            self.write_rows(self.rows)
+            self.rows = []
+        if self.fd is not None:
+            self.sync()
+
+    def sync(self):
+        self.fd.flush()
+
+    def close(self):
+        self.flush()
+        if self.fd is not None and self.path is not None:
+            self.fd.close()
+        self.fd = None
+
+
+class TextSink(Sink):
+    extension = ".txt"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.format = compile_template(self.template or "{r.term}, {r.message_id}")
+
+    def write_rows(self, rows):
+        self.fd.write("".join([f"{line}\n" for line in map(self.format, rows)]))
+
+
+class JSONLSink(Sink):
+    extension = ".jsonl"
+
+    def write_rows(self, rows):
+        dumps = ujson.dumps
+        self.fd.write("".join([f"{dumps(dict(zip(FIELDS, row)))}\n" for row in rows]))
+
+
+class CSVSink(Sink):
+    extension = ".csv"
+
+    def begin(self):
+        self.writer = csv.writer(self.fd)
+        if not self.fd.tell():
+            self.writer.writerow(FIELDS)
+
+    def write_rows(self, rows):
+        self.writer.writerows([row[:3] for row in rows])
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise RuntimeError(
+            'Parquet output requires the pyarrow package, pip install ".[parquet]"'
+        ) from exc
+    return pyarrow
+
+
+class ParquetSink(Sink):
+    """Writes results to a Parquet file, one row group per block.
+
+    Needs `pyarrow`, which is installed with the `parquet` extra.
+    """
+
+    extension = ".parquet"
+
+    def __init__(self, path=None, template=None, buffer_rows=65536):
+        if path is None:
+            raise ValueError("Parquet output needs an output path")
+        self.pyarrow = import_pyarrow()
+        super().__init__(path, template, buffer_rows)
+
+    def open(self):
+        pyarrow = self.pyarrow
+        self.schema = pyarrow.schema(
+            [
+                ("term", pyarrow.string()),
+                ("message_id", pyarrow.int64()),
+                ("unit", pyarrow.int16()),
+            ]
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return pyarrow.parquet.ParquetWriter(self.path, self.schema)
+
+    def restore(self, positions):
+        raise ValueError("Parquet output can't be resumed")
+
+    def sync(self):
+        # Row groups are written as they fill, the footer only on close
+        pass
+
+    def write_rows(self, rows):
+        terms, message_ids, units = list(zip(*rows))[:3]
+        columns = [terms, [int(message_id) for message_id in message_ids], units]
+        arrays = [
+            self.pyarrow.array(column, type=field.type)
+            for column, field in zip(columns, self.schema)
+        ]
+        table = self.pyarrow.Table.from_arrays(arrays, schema=self.schema)
+        self.fd.write_table(table)
+
+
+class PartitionedSink:
+    """Writes results to one sink per partition, in `key=value` directories.
+
+    Results are partitioned by `unit` or by the UTC `day` of their message.
+    """
+
+    keys = {"unit": attrgetter("unit"), "day": result_day}
+
+    def __init__(self, Sink, directory, partition_by, template=None):
+        self.Sink = Sink
+        self.directory = directory
+        self.partition_by = partition_by
+        self.template = template
+        self.key = self.keys[partition_by]
+        self.sinks = {}
+        self.restored = None
+
+    def write(self, result):
+        key = self.key(result)
+        sink = self.sinks.get(key)
+        if sink is None:
+            path = os.path.join(
+                self.directory,
+                f"{self.partition_by}={key}",
+                f"results{self.Sink.extension}",
+            )
+            sink = self.sinks[key] = self.Sink(path, self.template)
+            if self.restored is not None:
+                sink.restore(self.restored)
+        sink.write(result)
+
+    def positions(self):
+        positions = dict(self.restored or {})
+        for sink in self.sinks.values():
+            positions.update(sink.positions())
+        return positions
+
+    def restore(self, positions):
+        """Restores the partitions written to, later partitions are rewritten."""
+        self.restored = positions
+
+    def write_many(self, results):
+        for result in results:
+            self.write(result)
+
+    def flush(self):
+        for sink in self.sinks.values():
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks.values():
+            sink.close()
+
+
+sinks = {
+    "text": TextSink,
+    "jsonl": JSONLSink,
+    "csv": CSVSink,
+    "parquet": ParquetSink,
+}
+
+
+def open_sink(output_format="text", output=None, template=None, partition_by=None):
+    Sink = sinks[output_format]
+    if not partition_by:
+        return Sink(output, template)
+    if output is None:
+        raise ValueError("Partitioned output needs an output directory")
+    if Sink is ParquetSink:
+        # Partitions are opened on their first result, fail before the run
+        import_pyarrow()
+    return PartitionedSink(Sink, output, partition_by, template)
@@ -0,0 +1,244 @@
+import os
+import sys
+import threading
+import time
+
+import ujson
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as fd:
+            return int(fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def batch_size(item):
+    """Counts the records of the lists pushed by batch nodes."""
+    return len(item) if type(item) is list else 1
+
+
+class NodeStats:
+    __slots__ = ("items_in", "items_out", "total_ns", "push_ns")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.items_in = 0
+        self.items_out = 0
+        self.total_ns = 0
+        self.push_ns = 0
+
+    @property
+    def self_ns(self):
+        return self.total_ns - self.push_ns
+
+    def counters(self):
+        return (self.items_in, self.items_out, self.total_ns, self.push_ns)
+
+    def add(self, counters):
+        items_in, items_out, total_ns, push_ns = counters
+        self.items_in += items_in
+        self.items_out += items_out
+        self.total_ns += total_ns
+        self.push_ns += push_ns
+
+
+class PipelineStats:
+    """Per-node counters and timings of instrumented Glide pipelines.
+
+    Instrumenting a pipeline replaces the `process`, `push` and `end` of its
+    nodes with wrappers that count items in and out and time them. Since
+    pushes run downstream nodes inline, a node's self time excludes the time
+    spent in its pushes. While running, a thread samples the throughput of
+    the `source` node's output and the process memory every `interval`
+    seconds. Lists pushed by batch nodes count as their number of records.
+    Pipelines that aren't instrumented are left untouched.
+    """
+
+    def __init__(self, source="extract", interval=1.0):
+        self.source = source
+        self.interval = interval
+        self.nodes = {}
+        self.samples = []
+        self.elapsed = 0
+        self._started = None
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def instrument(self, pipeline):
+        nodes = pipeline.top_node.breadth_first_walk("down", as_ordered_list=True)
+        for node in nodes:
+            self.wrap(node, self.nodes.setdefault(node.name, NodeStats()))
+        return pipeline
+
+    @staticmethod
+    def wrap(node, stats):
+        clock = time.perf_counter_ns
+        process, end = node.process, node.end
+
+        def counted_push(item):
+            stats.items_out += batch_size(item)
+            start = clock()
+            counted_push.push(item)
+            stats.push_ns += clock() - start
+
+        def timed_process(item):
+            # Glide binds `push` when a run begins, so it's wrapped lazily
+            if node.push is not counted_push:
+                counted_push.push = node.push
+                node.push = counted_push
+            stats.items_in += batch_size(item)
+            start = clock()
+            process(item)
+            stats.total_ns += clock() - start
+
+        def timed_end():
+            start = clock()
+            end()
+            stats.total_ns += clock() - start
+
+        node.process = timed_process
+        node.end = timed_end
+
+    def drain(self):
+        """Returns the counters of every node and resets them."""
+        counters = {name: stats.counters() for name, stats in self.nodes.items()}
+        for stats in self.nodes.values():
+            stats.reset()
+        return counters
+
+    def merge(self, counters):
+        for name, values in counters.items():
+            self.nodes.setdefault(name, NodeStats()).add(values)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self.sample_loop, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+        self.elapsed += time.perf_counter() - self._started
+        self.sample()
+
+    def sample(self):
+        source = self.nodes.get(self.source)
+        items = source.items_out if source else 0
+        elapsed = time.perf_counter() - self._started
+        previous = self.samples[-1] if self.samples else dict(elapsed_s=0, items=0)
+        interval = elapsed - previous["elapsed_s"]
+        self.samples.append(
+            dict(
+                elapsed_s=round(elapsed, 3),
+                items=items,
+                items_per_sec=round((items - previous["items"]) / interval, 1)
+                if interval > 0
+                else 0,
+                rss_bytes=rss_bytes(),
+            )
+        )
+
+    def sample_loop(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def to_dict(self):
+        nodes = {}
+        for name, stats in self.nodes.items():
+            nodes[name] = dict(
+                items_in=stats.items_in,
+                items_out=stats.items_out,
+                selectivity=round(stats.items_out / stats.items_in, 4)
+                if stats.items_in
+                else None,
+                total_s=stats.total_ns / 1e9,
+                self_s=stats.self_ns / 1e9,
+            )
+        return dict(
+            elapsed_s=self.elapsed,
+            peak_rss_bytes=peak_rss_bytes(),
+            nodes=nodes,
+            samples=self.samples,
+        )
+
+    def format_table(self):
+        self_ns = sum(stats.self_ns for stats in self.nodes.values()) or 1
+        headers = ("node", "in", "out", "out/in", "total s", "self s", "self %")
+        rows = [headers]
+        for name, stats in self.nodes.items():
+            ratio = f"{stats.items_out / stats.items_in:.3f}" if stats.items_in else "-"
+            rows.append(
+                (
+                    name,
+                    str(stats.items_in),
+                    str(stats.items_out),
+                    ratio,
+                    f"{stats.total_ns / 1e9:.3f}",
+                    f"{stats.self_ns / 1e9:.3f}",
+                    f"{stats.self_ns / self_ns:.1%}",
+                )
+            )
+        widths = [max(len(row[idx]) for row in rows) for idx in range(len(headers))]
+        lines = [
+            "  ".join(
+                value.ljust(width) if idx == 0 else value.rjust(width)
+                for idx, (value, width) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        ]
+        lines.append(
+            f"elapsed: {self.elapsed:.3f}s, peak rss: {peak_rss_bytes() / 2 ** 20:.1f}MB"
+        )
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        metrics = [
+            ("toi_node_items_in_total", "counter", "Items processed by the node"),
+            ("toi_node_items_out_total", "counter", "Items pushed by the node"),
+            ("toi_node_seconds_total", "counter", "Time spent in the node"),
+            ("toi_node_self_seconds_total", "counter", "Time spent in the node itself"),
+        ]
+        lines = []
+        for (metric, kind, description), attr in zip(
+            metrics, ("items_in", "items_out", "total_ns", "self_ns")
+        ):
+            lines.append(f"# HELP {metric} {description}.")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, stats in self.nodes.items():
+                value = getattr(stats, attr)
+                value = value / 1e9 if attr.endswith("_ns") else value
+                lines.append(f'{metric}{{node="{name}"}} {value}')
+        lines += [
+            "# HELP toi_run_seconds Wall clock time of the run.",
+            "# TYPE toi_run_seconds gauge",
+            f"toi_run_seconds {self.elapsed}",
+            "# HELP toi_peak_rss_bytes Peak resident memory of the process.",
+            "# TYPE toi_peak_rss_bytes gauge",
+            f"toi_peak_rss_bytes {peak_rss_bytes()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the stats as Prometheus text to `.prom` paths, JSON otherwise."""
+        with open(path, "w") as fd:
+            if str(path).endswith(".prom"):
+                fd.write(self.to_prometheus())
+            else:
+                ujson.dump(self.to_dict(), fd, indent=2)
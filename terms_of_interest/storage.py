@@ -0,0 +1,107 @@
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+import ujson
+
+MAGIC = b"TOIMATCH"
+VERSION = 1
+ALIGNMENT = 8
+
+
+def padding(size):
+    return -size % ALIGNMENT
+
+
+def save_sections(path, kind, meta, sections, durable=False):
+    """Writes `sections`, a dict of name to `array` or `bytes`, to `path`.
+
+    The file holds the magic bytes, the size of a JSON header, the header and
+    then the raw sections it describes, each aligned to 8 bytes so numeric
+    sections can be used in place from a memory map.  With `durable`, the
+    file and its directory are synced to disk before returning.
+    """
+    entries = []
+    offset = 0
+    for name, data in sections.items():
+        typecode = data.typecode if isinstance(data, array) else "B"
+        length = len(data) * data.itemsize if isinstance(data, array) else len(data)
+        entries.append(dict(name=name, typecode=typecode, offset=offset, size=length))
+        offset += length + padding(length)
+
+    header = ujson.dumps(
+        dict(
+            version=VERSION,
+            byteorder=sys.byteorder,
+            kind=kind,
+            meta=meta,
+            sections=entries,
+        )
+    ).encode()
+    header += b" " * padding(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as fd:
+        fd.write(MAGIC)
+        fd.write(struct.pack("<Q", len(header)))
+        fd.write(header)
+        for data in sections.values():
+            data = data.tobytes() if isinstance(data, array) else bytes(data)
+            fd.write(data)
+            fd.write(b"\0" * padding(len(data)))
+        if durable:
+            fd.flush()
+            os.fsync(fd.fileno())
+    os.replace(tmp_path, path)
+    if durable:
+        fsync_directory(path)
+
+
+def fsync_directory(path):
+    """Syncs the directory entry of `path`, e.g. after replacing it."""
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def load_sections(path, kind):
+    """Reads the sections of a file written by `save_sections`.
+
+    Numeric sections are returned as memoryviews over a read-only memory map
+    of the file, byte sections as `bytes`.
+    """
+    with open(path, "rb") as fd:
+        mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapped)
+    if bytes(view[: len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not a matcher file")
+    (header_size,) = struct.unpack("<Q", view[len(MAGIC) : len(MAGIC) + 8])
+    start = len(MAGIC) + 8
+    header = ujson.loads(bytes(view[start : start + header_size]))
+    if header["version"] != VERSION or header["byteorder"] != sys.byteorder:
+        raise ValueError(f"{path} has an incompatible format")
+    if header["kind"] != kind:
+        raise ValueError(f"{path} holds a {header['kind']}, not a {kind}")
+
+    start += header_size
+    sections = {}
+    for entry in header["sections"]:
+        offset = start + entry["offset"]
+        data = view[offset : offset + entry["size"]]
+        sections[entry["name"]] = (
+            bytes(data) if entry["typecode"] == "B" else data.cast(entry["typecode"])
+        )
+    return header["meta"], sections
+
+
+def encode_strings(strings):
+    return "\n".join(strings).encode()
+
+
+def decode_strings(data, count):
+    return data.decode().split("\n") if count else []
@@ -6,14 +6,38 @@ class NaiveTokenizer:
         """Breaks string into lowercase word tokens."""
         return iter(string.strip().lower().split())
 
+    def tokenize_many(self, strings):
+        """Lazily breaks a batch of strings into lists of lowercase word tokens."""
+        return (string.lower().split() for string in strings)
+
+    def normalize(self, string):
+        """Returns a string with the same tokens, for use as a cache key."""
+        return string.lower()
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
 
 class NgramTokenizer:
     def __init__(self, tokenizer=NaiveTokenizer(), max_len=3):
         self.tokenizer = tokenizer
         self.max_len = max_len
 
+    def __repr__(self):
+        return f"{type(self).__name__}({self.tokenizer!r}, max_len={self.max_len})"
+
+    def normalize(self, text):
+        return self.tokenizer.normalize(text)
+
     def tokenize(self, text):
         for ngram in everygrams(
             tuple(self.tokenizer.tokenize(text)), max_len=self.max_len
         ):
             yield " ".join(ngram)
+
+    def tokenize_many(self, texts):
+        for words in self.tokenizer.tokenize_many(texts):
+            yield [
+                " ".join(ngram)
+                for ngram in everygrams(tuple(words), max_len=self.max_len)
+            ]
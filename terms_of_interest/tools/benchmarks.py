@@ -1,7 +1,13 @@
+import contextlib
+import math
+import os
 import string
+import tempfile
 import time
 from collections import Counter
 
+import ujson
+
 from columnar import columnar
 from pympler.asizeof import asizeof
 from nltk.corpus import gutenberg
@@ -14,7 +20,10 @@ from nltk.collocations import (
 )
 
 
-from ..matchers import benchmark_algolist
+from . import synthetic
+from .. import db, util
+from ..matchers import benchmark_algolist, termset_algos
+from ..pipeline import MatchResult, PipelineBuilder
 
 
 def clean_text(corpus):
@@ -46,25 +55,6 @@ def find_top_ngrams(words, n):
     return set(top_trigrams + top_bigrams_in_trigrams + top_bigrams + top_unigrams)
 
 
-def profile_algo(algo, terms, sents, runs=5):
-    termset = algo().add_terms(terms).build()
-
-    times = []
-    for _ in range(runs):
-        start = time.time()
-        for sent in sents:
-            termset.query(sent)
-        end = time.time()
-        duration = end - start
-
-        times.append(duration)
-
-    ttl_time = sum(times)
-    avg_time = ttl_time / runs
-    memory = asizeof(termset) // 1000
-    return [algo.name, f"{ttl_time:.4f}s", f"{avg_time:.4f}s", f"{memory:}k"]
-
-
 def words_to_sents(words, num_words=5):
     sents = []
     total_words = len(words)
@@ -80,33 +70,332 @@ def words_to_sents(words, num_words=5):
     return sents
 
 
+# Metrics compared against a baseline, with whether higher values are better
+METRICS = {
+    "build_ms": False,
+    "p50_us": False,
+    "p95_us": False,
+    "p99_us": False,
+    "queries_per_sec": True,
+    "batch_queries_per_sec": True,
+    "tweets_per_sec": True,
+    "batch_tweets_per_sec": True,
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return 0
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+def profile_algo(algo, terms, texts, runs=5, memory=False):
+    start = time.perf_counter_ns()
+    termset = algo().add_terms(terms).build()
+    build_ns = time.perf_counter_ns() - start
+
+    latencies = []
+    batch_ns = 0
+    clock = time.perf_counter_ns
+    for _ in range(runs):
+        for text in texts:
+            start = clock()
+            termset.query(text)
+            latencies.append(clock() - start)
+
+        start = clock()
+        termset.query_many(texts)
+        batch_ns += clock() - start
+
+    latencies.sort()
+    queries = len(texts) * runs
+    result = dict(
+        build_ms=build_ns / 1e6,
+        p50_us=percentile(latencies, 50) / 1e3,
+        p95_us=percentile(latencies, 95) / 1e3,
+        p99_us=percentile(latencies, 99) / 1e3,
+        queries_per_sec=queries / (sum(latencies) / 1e9) if latencies else 0,
+        batch_queries_per_sec=queries / (batch_ns / 1e9) if batch_ns else 0,
+    )
+    if memory:
+        result["memory_kb"] = asizeof(termset) // 1000
+    return result
+
+
+def time_pipeline(termset_algo, data_path, units, runs=1, batch=False):
+    builder = PipelineBuilder(units=units, batch=batch)
+    builder.build().set_context(termset_algo)
+    durations = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(runs):
+            start = time.perf_counter_ns()
+            builder.run([data_path])
+            durations.append(time.perf_counter_ns() - start)
+    return sum(durations) / 1e9
+
+
+def profile_pipeline(termset_algo, data_path, units, tweets, runs=1):
+    total = time_pipeline(termset_algo, data_path, units, runs)
+    batch_total = time_pipeline(termset_algo, data_path, units, runs, batch=True)
+    return dict(
+        total_s=total,
+        tweets_per_sec=tweets * runs / total if total else 0,
+        batch_tweets_per_sec=tweets * runs / batch_total if batch_total else 0,
+    )
+
+
+def compare_results(results, baseline, threshold=0.1):
+    """Diffs `results` against `baseline` results.
+
+    Returns table rows and the number of metrics that got worse by more than
+    `threshold`, a fraction of the baseline value.
+    """
+    rows = []
+    regressions = 0
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get(name, {}).get(metric)
+            if metric not in METRICS or not previous:
+                continue
+            change = (value - previous) / previous
+            worse = -change if METRICS[metric] else change
+            status = "REGRESSION" if worse > threshold else ""
+            regressions += bool(status)
+            rows.append(
+                [name, metric, f"{previous:.2f}", f"{value:.2f}", f"{change:+.1%}", status]
+            )
+    return rows, regressions
+
+
+MATCHER_COLUMNS = [
+    ("build_ms", "build ms"),
+    ("p50_us", "p50 us"),
+    ("p95_us", "p95 us"),
+    ("p99_us", "p99 us"),
+    ("queries_per_sec", "queries/sec"),
+    ("batch_queries_per_sec", "batch/sec"),
+    ("memory_kb", "memory"),
+]
+PIPELINE_COLUMNS = [
+    ("total_s", "total time"),
+    ("tweets_per_sec", "tweets/sec"),
+    ("batch_tweets_per_sec", "batch/sec"),
+]
+
+
+def print_results(results, kind, columns):
+    results = {
+        name.split("/", 1)[1]: metrics
+        for name, metrics in results.items()
+        if name.startswith(f"{kind}/")
+    }
+    columns = [
+        (metric, header)
+        for metric, header in columns
+        if any(metric in metrics for metrics in results.values())
+    ]
+    rows = [
+        [name] + [f"{metrics[metric]:.2f}" for metric, _ in columns]
+        for name, metrics in results.items()
+    ]
+    if rows:
+        headers = [kind] + [header for _, header in columns]
+        print(columnar(rows, headers, no_borders=True, justify="r"))
+
+
 def main(
-    fileid,
     algos_to_include,
-    words_per_sentence=30,
-    top_ngrams=100000,
     runs=1,
+    seed=0,
+    tweets=10000,
+    words_per_tweet=20,
+    vocab_size=5000,
+    skew=1.1,
+    terms=1000,
+    pipeline=True,
+    memory=False,
+    fileid=None,
+    top_ngrams=100,
+    output=None,
+    compare=None,
+    threshold=0.1,
 ):
+    """Runs the matcher, and optionally end-to-end pipeline, benchmarks.
 
+    Data is generated from `seed` unless a Gutenberg `fileid` is given, which
+    needs the NLTK corpus and only benchmarks the matchers. Returns the number
+    of regressions against the `compare` baseline file.
+    """
     algos = [algo for algo in benchmark_algolist if algo.name in algos_to_include]
-    corpus = gutenberg.raw(fileid)
-    moby_dick = clean_text(corpus)
-    words = moby_dick.split()
-    sents = words_to_sents(words, num_words=words_per_sentence)
-    top_ngrams = find_top_ngrams(words, top_ngrams)
+    config = dict(seed=seed, runs=runs)
+    if fileid:
+        words = clean_text(gutenberg.raw(fileid)).split()
+        texts = words_to_sents(words, num_words=words_per_tweet)
+        termset = list(find_top_ngrams(words, top_ngrams))
+        config.update(fileid=fileid, top_ngrams=top_ngrams)
+        pipeline = False
+    else:
+        config.update(
+            tweets=tweets,
+            words_per_tweet=words_per_tweet,
+            vocab_size=vocab_size,
+            skew=skew,
+            terms=terms,
+        )
+        dataset = synthetic.generate(
+            seed=seed,
+            tweets=tweets,
+            words_per_tweet=words_per_tweet,
+            vocab_size=vocab_size,
+            skew=skew,
+            terms=terms,
+        )
+        texts = dataset["texts"]
+        termset = dataset["termsets"][0]
+
+    print("\n".join(f"{key}: {value}" for key, value in config.items()))
+    results = {
+        f"matcher/{algo.name}": profile_algo(algo, termset, texts, runs, memory)
+        for algo in algos
+    }
+
+    if pipeline:
+        algo_keys = {algo: key for key, algo in termset_algos.items()}
+        with tempfile.TemporaryDirectory() as directory:
+            data_path, units = synthetic.write(dataset, directory)
+            for algo in algos:
+                results[f"pipeline/{algo.name}"] = profile_pipeline(
+                    algo_keys[algo], data_path, units, tweets, runs
+                )
+    print_results(results, "matcher", MATCHER_COLUMNS)
+    print_results(results, "pipeline", PIPELINE_COLUMNS)
+
+    if output:
+        with open(output, "w") as fd:
+            ujson.dump(
+                dict(config=config, results=results),
+                fd,
+                indent=2,
+                escape_forward_slashes=False,
+            )
+
+    if not compare:
+        return 0
+    with open(compare) as fd:
+        baseline = ujson.load(fd)
+    if baseline["config"] != config:
+        print(f"Warning: baseline was run with {baseline['config']}")
+    rows, regressions = compare_results(results, baseline["results"], threshold)
+    headers = ["benchmark", "metric", "baseline", "current", "change", ""]
+    print(columnar(rows, headers, no_borders=True, justify="r"))
+    print(f"{regressions} regressions over {threshold:.0%}")
+    return regressions
+
+
+def load_rows_orm(dal, rows, batch_size):
+    session = dal.Session()
+    for row in rows:
+        session.add(db.Results(term=row.term, message_id=row.message_id))
+        session.commit()
+
+
+def load_rows_bulk(dal, rows, batch_size, threaded=False, writer=db.BulkWriter):
+    writer = writer(dal.engine, batch_size=batch_size, threaded=threaded)
+    for row in rows:
+        writer.add(row)
+    writer.flush()
+
+
+def load_rows_threaded(dal, rows, batch_size):
+    load_rows_bulk(dal, rows, batch_size, threaded=True)
+
+
+def load_rows_compact(dal, rows, batch_size):
+    load_rows_bulk(dal, rows, batch_size, threaded=True, writer=db.CompactBulkWriter)
+
+
+def profile_loader(name, loader, dal, rows, batch_size):
+    db.Base.metadata.drop_all(dal.engine)
+    db.Base.metadata.create_all(dal.engine)
+
+    start = time.perf_counter()
+    loader(dal, rows, batch_size)
+    duration = time.perf_counter() - start
+
+    return [name, f"{duration:.4f}s", f"{len(rows) / duration:.0f}"]
+
+
+def db_main(
+    db_uri="sqlite:///benchmark.db", rows=10000, batch_size=1000, sqlite_pragmas=None
+):
+    dal = db.DataAccessLayer(db_uri, sqlite_pragmas=sqlite_pragmas).connect()
+    rows = [
+        MatchResult(f"term {idx % 100}", str(1115339928542564352 + idx), idx % 2 + 1)
+        for idx in range(rows)
+    ]
+    loaders = [
+        ("Row per transaction", load_rows_orm),
+        ("Batched", load_rows_bulk),
+        ("Batched + writer thread", load_rows_threaded),
+        ("Compact + writer thread", load_rows_compact),
+    ]
+
+    print(
+        "\n".join(
+            [f"Database: {db_uri}", f"Rows: {len(rows)}", f"Batch size: {batch_size}"]
+        )
+    )
+
+    headers = ["loader", "total time", "rows/sec"]
+    results = [
+        profile_loader(name, loader, dal, rows, batch_size) for name, loader in loaders
+    ]
+    table = columnar(results, headers, no_borders=True, justify="r")
+    print(table)
+
+
+def read_file_lines(path):
+    with open(path) as fd:
+        for line in fd:
+            yield line.rstrip()
+
+
+def read_mapped_chunks(path):
+    for chunk in util.read_chunks(path):
+        yield chunk.decode()
+
+
+def profile_reader(name, reader, path, runs):
+    size = os.path.getsize(path) * runs
+    count = 0
+    start = time.perf_counter()
+    for _ in range(runs):
+        for _ in reader(path):
+            count += 1
+    duration = time.perf_counter() - start
+    return [
+        name,
+        f"{duration:.4f}s",
+        f"{size / duration / 1024 ** 2:.1f}",
+        f"{count / duration:.0f}",
+    ]
+
+
+def reader_main(path, runs=1):
+    readers = [
+        ("File lines", read_file_lines),
+        ("Memory-mapped lines", util.read_lines),
+        ("Memory-mapped chunks", read_mapped_chunks),
+    ]
 
     print(
         "\n".join(
-            [
-                f"Ngrams: {len(top_ngrams)}",
-                f"Sentences: {len(sents)}",
-                f"Words/sentence: {words_per_sentence}",
-                f"Runs: {runs}",
-            ]
+            [f"File: {path}", f"Size: {os.path.getsize(path) // 1000}k", f"Runs: {runs}"]
         )
     )
 
-    headers = ["name", "total time", "average time", "memory"]
-    results = [profile_algo(algo, top_ngrams, sents, runs) for algo in algos]
+    headers = ["reader", "total time", "MB/sec", "items/sec"]
+    results = [profile_reader(name, reader, path, runs) for name, reader in readers]
     table = columnar(results, headers, no_borders=True, justify="r")
     print(table)
@@ -0,0 +1,115 @@
+from datetime import date, datetime, timedelta, timezone
+import itertools
+import os
+import random
+import string
+
+import ujson
+
+from ..index import SNOWFLAKE_EPOCH
+from ..schemas import TIMESTAMP_FORMAT
+
+
+def make_vocab(rng, size):
+    vocab = {}
+    while len(vocab) < size:
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9)))
+        vocab.setdefault(word, None)
+    return list(vocab)
+
+
+def make_texts(rng, vocab, count, words_per_text, skew):
+    """Samples texts from `vocab` with Zipf distributed word frequencies.
+
+    `skew` is the Zipf exponent, 0 samples words uniformly.
+    """
+    cum_weights = list(
+        itertools.accumulate(1 / rank ** skew for rank in range(1, len(vocab) + 1))
+    )
+    return [
+        " ".join(rng.choices(vocab, cum_weights=cum_weights, k=words_per_text))
+        for _ in range(count)
+    ]
+
+
+def make_terms(rng, texts, count, max_words=3):
+    """Samples `count` distinct 1 to `max_words` word ngrams out of `texts`."""
+    terms = {}
+    for _ in range(count * 100):
+        if len(terms) >= count:
+            break
+        words = rng.choice(texts).split()
+        size = rng.randint(1, min(max_words, len(words)))
+        start = rng.randrange(len(words) - size + 1)
+        terms.setdefault(" ".join(words[start : start + size]), None)
+    return list(terms)
+
+
+def make_tweets(rng, texts, node_ids, start=date(2019, 4, 8), days=1):
+    """Builds tweets with snowflake message ids spread over `days` from `start`."""
+    start = datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+    step = timedelta(days=days) / max(len(texts), 1)
+    tweets = []
+    for idx, text in enumerate(texts):
+        message_time = start + step * idx
+        millis = int(message_time.timestamp() * 1000) - SNOWFLAKE_EPOCH
+        tweets.append(
+            dict(
+                text=text,
+                node_id=rng.choice(node_ids),
+                message_id=str(millis << 22 | rng.getrandbits(22)),
+                message_time=message_time.strftime(TIMESTAMP_FORMAT),
+            )
+        )
+    return tweets
+
+
+def generate(
+    seed=0,
+    tweets=10000,
+    words_per_tweet=20,
+    vocab_size=5000,
+    skew=1.1,
+    terms=1000,
+    users=10000,
+    userset_size=400,
+    units=2,
+    days=1,
+):
+    """Generates a reproducible dataset of tweets, termsets and usersets.
+
+    Termsets are sampled from the tweet texts so they match at a realistic
+    rate, usersets are sampled from the users tweets are authored by.
+    """
+    rng = random.Random(seed)
+    vocab = make_vocab(rng, vocab_size)
+    texts = make_texts(rng, vocab, tweets, words_per_tweet, skew)
+    node_ids = [str(rng.randrange(10 ** 7, 10 ** 18)) for _ in range(users)]
+    return dict(
+        texts=texts,
+        tweets=make_tweets(rng, texts, node_ids, days=days),
+        termsets=[make_terms(rng, texts, terms) for _ in range(units)],
+        usersets=[rng.sample(node_ids, min(userset_size, users)) for _ in range(units)],
+    )
+
+
+def write(dataset, directory):
+    """Writes `dataset` as files, returns the data path and pipeline units."""
+    os.makedirs(directory, exist_ok=True)
+    data_path = os.path.join(directory, "tweets.jsonl")
+    with open(data_path, "w") as fd:
+        fd.writelines(f"{ujson.dumps(tweet)}\n" for tweet in dataset["tweets"])
+
+    units = []
+    for idx, (termset, userset) in enumerate(
+        zip(dataset["termsets"], dataset["usersets"]), start=1
+    ):
+        unit = dict(
+            userset=os.path.join(directory, f"nodes{idx}.txt"),
+            termset=os.path.join(directory, f"terms{idx}.txt"),
+        )
+        for key, lines in (("userset", userset), ("termset", termset)):
+            with open(unit[key], "w") as fd:
+                fd.writelines(f"{line}\n" for line in lines)
+        units.append(unit)
+    return data_path, units
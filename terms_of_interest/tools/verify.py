@@ -1,27 +1,135 @@
+import collections
+import multiprocessing
+import sys
+import time
+
+from .. import util
+from ..index import MESSAGE_ID
 from ..schemas import Tweet
 
 
 class ResultsVerifier:
-    def load_messages(self, tweets_file):
-        messages = {}
-        for line in tweets_file:
-            tweet = Tweet.parse_raw(line)
-            messages[tweet.message_id] = tweet.text.lower()
-        return messages
-
-    def verify(self, results_file):
+    """Verifies that every term of a results file is in the text of its tweet.
+
+    The results are read first to collect the referenced message ids, then
+    DATA is streamed in shards, across `workers` processes, and only the
+    lines of referenced messages are decoded, so memory is bounded by the
+    size of the results rather than of DATA.
+    """
+
+    def __init__(self, workers=1, shard_size=64 * 1024 ** 2, progress=False):
+        self.workers = workers
+        self.shard_size = shard_size
+        self.progress = progress
+
+    @staticmethod
+    def load_results(results_file):
+        """Maps referenced message ids, as bytes, to `(line_num, term)` results."""
+        results = collections.defaultdict(list)
         for idx, line in enumerate(results_file):
             term, message_id = line.rstrip().split(", ")
-            if not term in self.messages[message_id]:
-                self.print_error(idx, term, message_id)
+            results[message_id.encode()].append((idx, term))
+        return results
+
+    def verify_shards(self, shards):
+        if self.workers == 1:
+            _init_verify_worker(self.results)
+            yield from map(_verify_shard, shards)
+            return
+
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with mp_context.Pool(
+            self.workers, initializer=_init_verify_worker, initargs=(self.results,)
+        ) as pool:
+            yield from pool.imap_unordered(_verify_shard, shards)
+
+    def verify(self, tweets_path):
+        shards = util.split_files([tweets_path], self.workers, self.shard_size)
+        passed, failed, found = set(), {}, set()
+        size = lines = 0
+        start = time.perf_counter()
+        for done, shard in enumerate(self.verify_shards(shards), start=1):
+            passed.update(shard["passed"])
+            failed.update(shard["failed"])
+            found.update(shard["found"])
+            size += shard["size"]
+            lines += shard["lines"]
+            if self.progress or done == len(shards):
+                self.print_progress(done, len(shards), size, lines, start)
+        print(file=sys.stderr)
+
+        unverified = sorted(
+            (idx, term, message_id)
+            for message_id, results in self.results.items()
+            for idx, term in results
+            if idx not in passed
+        )
+        for idx, term, message_id in unverified:
+            if message_id in found:
+                self.print_error(idx, term, message_id.decode(), failed[idx])
+            else:
+                self.print_missing(idx, message_id.decode())
+        return found
+
+    @staticmethod
+    def print_progress(done, total, size, lines, start):
+        duration = max(time.perf_counter() - start, 1e-9)
+        megabytes = size / 1024 ** 2
+        print(
+            f"\r[{done}/{total}] {megabytes:.1f}MB, {lines} lines in {duration:.2f}s "
+            f"({megabytes / duration:.1f}MB/sec, {lines / duration:.0f} lines/sec)",
+            end="",
+            file=sys.stderr,
+        )
 
-    def print_error(self, line_num, term, message_id):
+    def print_error(self, line_num, term, message_id, text):
         print(
             f"[!] Line: {line_num} Term: '{term}' not found in message_id: '{message_id}'"
         )
-        print(f"    Message Text: '{self.messages[message_id]}'")
+        print(f"    Message Text: '{text}'")
+
+    def print_missing(self, line_num, message_id):
+        print(f"[!] Line: {line_num} message_id: '{message_id}' not found in data")
+
+    def run(self, tweets_path, results_file):
+        self.results = self.load_results(results_file)
+        found = self.verify(tweets_path)
+        print(f"Verified {len(found)} messages!")
+
+
+_verify_results = None
+
+
+def _init_verify_worker(results):
+    global _verify_results
+    _verify_results = results
+
+
+def _verify_shard(shard):
+    """Checks the results of the referenced messages in a shard of DATA.
 
-    def run(self, tweets_file, results_file):
-        self.messages = self.load_messages(tweets_file)
-        self.verify(results_file)
-        print(f"Verified {len(self.messages)} messages!")
+    Returns the result lines that passed, the texts of the ones that failed
+    and the message ids found, with the bytes and lines read.
+    """
+    results = _verify_results
+    passed, failed, found = [], {}, set()
+    size = lines = 0
+    for chunk in util.read_chunks(*shard):
+        size += len(chunk)
+        lines += chunk.count(b"\n")
+        for match in MESSAGE_ID.finditer(chunk):
+            message_id = match.group(1)
+            if message_id not in results:
+                continue
+            start = chunk.rfind(b"\n", 0, match.start()) + 1
+            end = chunk.find(b"\n", match.end())
+            tweet = Tweet.parse_raw(chunk[start : end if end >= 0 else len(chunk)])
+            text = tweet.text.lower()
+            found.add(message_id)
+            for idx, term in results[message_id]:
+                if term in text:
+                    passed.append(idx)
+                else:
+                    failed[idx] = text
+    return dict(passed=passed, failed=failed, found=found, size=size, lines=lines)
@@ -1,12 +1,49 @@
+import bz2
+import contextlib
+import functools
+import gc
+import gzip
+import itertools
+import lzma
+import mmap
+import os
+import queue
+import threading
+
 import ujson
 
+CHUNK_SIZE = 64 * 1024
+
+# Units are routed with 64-bit bitmasks
+MAX_UNITS = 64
+
+COMPRESSION_EXTENSIONS = {".gz": "gz", ".bz2": "bz2", ".xz": "xz", ".zst": "zst"}
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gz",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zst",
+}
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Pauses the cyclic garbage collector, which otherwise runs over and
+    over while many container objects are allocated."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
 
 def process_file(path, line_filter, line_map=None):
-    with open(path) as fd:
-        for line in fd:
-            line = line.rstrip()
-            if line_filter(line):
-                yield line_map(line) if line_map else line
+    for line in read_lines(path):
+        line = line.rstrip()
+        if line_filter(line):
+            yield line_map(line) if line_map else line
 
 
 def readlines(path):
@@ -15,3 +52,245 @@ def readlines(path):
 
 def readtweets(path):
     yield from process_file(path, bool, ujson.loads)
+
+
+def read_units(path):
+    """Reads a JSON units config, `{"units": [{"userset": ..., "termset": ...}]}`.
+
+    Userset and termset paths are relative to the directory of the config, at
+    most `MAX_UNITS` units are allowed.
+    """
+    with open(path) as fd:
+        config = ujson.load(fd)
+    units = config.get("units") if isinstance(config, dict) else None
+    if not units or not isinstance(units, list):
+        raise ValueError(f"{path} has no list of units")
+    if len(units) > MAX_UNITS:
+        raise ValueError(f"{path} has {len(units)} units, at most {MAX_UNITS} allowed")
+
+    base = os.path.dirname(path)
+    results = []
+    for idx, unit in enumerate(units, start=1):
+        if not isinstance(unit, dict) or not {"userset", "termset"} <= unit.keys():
+            raise ValueError(f"Unit {idx} of {path} needs a userset and a termset")
+        unit = {key: os.path.join(base, unit[key]) for key in ("userset", "termset")}
+        for filepath in unit.values():
+            if not os.path.exists(filepath):
+                raise ValueError(f"Unit {idx} of {path}: {filepath} does not exist")
+        results.append(unit)
+    return results
+
+
+def split_range(path, start, end, count):
+    """Splits a byte range of a file into `count` newline-aligned sub-ranges."""
+    bounds = [start]
+    with open(path, "rb") as fd:
+        for idx in range(1, count):
+            offset = max(start + (end - start) * idx // count, bounds[-1])
+            if offset >= end:
+                break
+            fd.seek(max(offset - 1, 0))
+            fd.readline()
+            bounds.append(min(fd.tell(), end))
+    bounds.append(end)
+    return [(path, lo, hi) for lo, hi in zip(bounds, bounds[1:]) if hi > lo]
+
+
+def split_file(path, count):
+    """Splits a file into `count` newline-aligned `(path, start, end)` byte ranges."""
+    return split_range(path, 0, os.path.getsize(path), count)
+
+
+def split_files(shards, workers, shard_size=64 * 1024 ** 2):
+    """Splits files, or `(path, start, end)` ranges of files, into shards for
+    `workers` processes.
+
+    Whole files are used as shards when there are at least as many files as
+    workers, otherwise files are split into newline-aligned byte ranges.
+    Shards are never larger than `shard_size` bytes, except for compressed
+    files which are always used whole.
+    """
+    shards = [to_shard(shard) for shard in shards]
+    per_file = -(-workers // len(shards)) if shards else 1
+    split = []
+    for path, start, end in shards:
+        if detect_compression(path):
+            split.append((path, start, end))
+            continue
+        count = max(per_file, -(-(end - start) // shard_size))
+        split.extend(split_range(path, start, end, count))
+    return split
+
+
+def to_shard(shard):
+    """Normalizes a path or `(path, start, end)` range to a full byte range."""
+    if isinstance(shard, (str, os.PathLike)):
+        shard = (shard, 0, None)
+    path, start, end = shard
+    return (path, start, os.path.getsize(path) if end is None else end)
+
+
+def detect_compression(path):
+    """Returns the compression of a file from its extension or magic bytes."""
+    compression = COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if compression:
+        return compression
+    with open(path, "rb") as fd:
+        head = fd.read(6)
+    for magic, compression in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_compressed(path, compression):
+    if compression == "gz":
+        return gzip.open(path, "rb")
+    if compression == "bz2":
+        return bz2.open(path, "rb")
+    if compression == "xz":
+        return lzma.open(path, "rb")
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise RuntimeError(
+            f"Reading {path} requires the zstandard package, pip install zstandard"
+        ) from exc
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+
+def read_ahead(produce, queue_size=16):
+    """Yields the items of the iterable returned by `produce`, which is
+    iterated on a background thread at most `queue_size` items ahead of the
+    consumer."""
+    items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fill():
+        try:
+            for item in produce():
+                if not put(item):
+                    return
+            put(done)
+        except Exception as exc:
+            put(exc)
+
+    threading.Thread(target=fill, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def read_compressed_chunks(path, compression, chunk_size=CHUNK_SIZE, queue_size=16):
+    """Yields newline-aligned chunks of bytes of a compressed file.
+
+    Decompression runs on a background thread, at most `queue_size` blocks
+    ahead of the consumer.
+    """
+
+    def decompress():
+        with open_compressed(path, compression) as fd:
+            yield from iter(functools.partial(fd.read, chunk_size), b"")
+
+    rest = b""
+    for block in read_ahead(decompress, queue_size):
+        newline = block.rfind(b"\n")
+        if newline < 0:
+            rest += block
+            continue
+        yield rest + block[: newline + 1]
+        rest = block[newline + 1 :]
+    if rest:
+        yield rest
+
+
+def read_stream(fd, batch_size=1000, queue_size=16, chunk_size=CHUNK_SIZE):
+    """Yields lists of the non-empty lines of a binary stream as they arrive.
+
+    A background thread reads `fd`, e.g. stdin or a named pipe, and queues a
+    batch of `batch_size` lines, or fewer when no more data was ready, so
+    batches stay small while the stream is slow.  At most `queue_size`
+    batches are queued: when the consumer falls behind, the thread stops
+    reading and the writer blocks on the full pipe.
+    """
+    read = getattr(fd, "read1", fd.read)
+
+    def batches():
+        rest, lines = b"", []
+        for block in iter(functools.partial(read, chunk_size), b""):
+            newline = block.rfind(b"\n")
+            if newline < 0:
+                rest += block
+                continue
+            chunk, rest = rest + block[: newline + 1], block[newline + 1 :]
+            lines.extend(filter(None, chunk.decode().split("\n")))
+            while len(lines) >= batch_size:
+                yield lines[:batch_size]
+                lines = lines[batch_size:]
+            if lines and len(block) < chunk_size:
+                yield lines
+                lines = []
+        lines.extend(filter(None, rest.decode().split("\n")))
+        if lines:
+            yield lines
+
+    return read_ahead(batches, queue_size)
+
+
+def read_chunks(path, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """Yields newline-aligned chunks of bytes between the byte offsets `start`
+    and `end` of a memory-mapped file.
+
+    Chunks are about `chunk_size` bytes, longer when a line doesn't fit.
+    Compressed files are decompressed as a stream and can only be read whole.
+    """
+    compression = detect_compression(path)
+    if compression:
+        if start:
+            raise ValueError(f"Can't read byte ranges of compressed file {path}")
+        yield from read_compressed_chunks(path, compression, chunk_size)
+        return
+
+    with open(path, "rb") as fd:
+        size = os.fstat(fd.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            pos = start
+            while pos < end:
+                stop = min(pos + chunk_size, end)
+                if stop < end:
+                    newline = mapped.rfind(b"\n", pos, stop)
+                    if newline < 0:
+                        newline = mapped.find(b"\n", stop, end)
+                    stop = newline + 1 if newline >= 0 else end
+                yield mapped[pos:stop]
+                pos = stop
+
+
+def read_lines(path, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """Iterates over the non-empty lines, without line endings, between the
+    byte offsets `start` and `end` of a file."""
+    chunks = read_chunks(path, start, end, chunk_size)
+    return itertools.chain.from_iterable(
+        filter(None, chunk.decode().split("\n")) for chunk in chunks
+    )
@@ -0,0 +1,33 @@
+from terms_of_interest.tools import synthetic
+from terms_of_interest.tools.benchmarks import compare_results, percentile
+from terms_of_interest.pipeline import PipelineBuilder
+
+
+def test_synthetic_generate_is_reproducible(tmp_path, capsys):
+    dataset = synthetic.generate(seed=7, tweets=200, terms=50, users=100)
+    assert dataset == synthetic.generate(seed=7, tweets=200, terms=50, users=100)
+    assert dataset != synthetic.generate(seed=8, tweets=200, terms=50, users=100)
+    assert len(dataset["termsets"][0]) == 50
+
+    data_path, units = synthetic.write(dataset, tmp_path)
+    PipelineBuilder(units=units).build().set_context().run([data_path])
+    assert capsys.readouterr().out
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 99) == 0
+
+
+def test_compare_results_flags_regressions():
+    baseline = {"matcher/Trie": {"p99_us": 10.0, "queries_per_sec": 1000.0}}
+    results = {"matcher/Trie": {"p99_us": 12.0, "queries_per_sec": 1050.0}}
+    rows, regressions = compare_results(results, baseline, threshold=0.1)
+    assert regressions == 1
+    assert [row[-1] for row in rows] == ["REGRESSION", ""]
+
+    results = {"matcher/Trie": {"p99_us": 9.0, "queries_per_sec": 850.0}}
+    assert compare_results(results, baseline, threshold=0.1)[1] == 1
+    assert compare_results(results, baseline, threshold=0.2)[1] == 0
@@ -0,0 +1,107 @@
+import pytest
+
+from terms_of_interest.checkpoint import Checkpoint
+from terms_of_interest.dedup import RotatingBloomFilter
+from terms_of_interest.pipeline import PipelineBuilder
+
+from .test_pipeline import build_test_units
+
+
+def test_checkpoint_remaining_ranges(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_bytes(b"x\n" * 50)
+    checkpoint = Checkpoint(str(tmp_path / "state.json"))
+    checkpoint.mark(str(path), 10, 20)
+    checkpoint.mark(str(path), 0, 10)
+    checkpoint.mark(str(path), 40, 50)
+
+    assert checkpoint.files[str(path)]["done"] == [[0, 20], [40, 50]]
+    assert list(checkpoint.remaining([str(path)])) == [
+        (str(path), 20, 40),
+        (str(path), 50, 100),
+    ]
+    assert list(checkpoint.remaining([(str(path), 0, 20)])) == []
+
+    checkpoint.save({"out.txt": 3}, db=7)
+    loaded = Checkpoint(str(tmp_path / "state.json"))
+    assert loaded.load()
+    assert (loaded.outputs, loaded.db) == ({"out.txt": 3}, 7)
+
+    path.write_bytes(b"x\n" * 60)
+    assert list(loaded.remaining([str(path)])) == [(str(path), 0, 120)]
+
+
+class CrashingCheckpoint(Checkpoint):
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        raise RuntimeError("crash")
+
+
+def run_checkpointed(
+    tmp_path, units, checkpoint, resume=False, db_uri=None, dedup=None
+):
+    builder = PipelineBuilder(
+        units=units,
+        output=str(tmp_path / "results.txt"),
+        db_uri=db_uri,
+        db_load=True,
+        checkpoint=checkpoint,
+        dedup=dedup,
+    )
+    builder.build().set_context()
+    builder.context["extract"] = dict(chunk_size=2000)
+    builder.run([str(tmp_path / "tweets.jsonl")], resume=resume)
+    return builder
+
+
+def test_PipelineBuilder_resume(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'results.db'}"
+    state = str(tmp_path / "state.json")
+    units = build_test_units(tmp_path)
+    checkpoint = CrashingCheckpoint(state, interval=5000)
+    with pytest.raises(RuntimeError):
+        run_checkpointed(tmp_path, units, checkpoint, db_uri=db_uri)
+    assert 0 < checkpoint.db < 100
+
+    builder = run_checkpointed(
+        tmp_path, units, Checkpoint(state), resume=True, db_uri=db_uri
+    )
+    results = (tmp_path / "results.txt").read_text().splitlines()
+    assert len(results) == 100
+    assert builder.db_writer.position() == 100
+
+    builder = run_checkpointed(
+        tmp_path, units, Checkpoint(state), resume=True, db_uri=db_uri
+    )
+    assert (tmp_path / "results.txt").read_text().splitlines() == results
+    assert builder.db_writer.position() == 100
+
+
+def test_PipelineBuilder_resume_dedup(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'results.db'}"
+    state = str(tmp_path / "state.json")
+    units = build_test_units(tmp_path)
+    checkpoint = CrashingCheckpoint(state, interval=5000)
+    with pytest.raises(RuntimeError):
+        run_checkpointed(
+            tmp_path,
+            units,
+            checkpoint,
+            db_uri=db_uri,
+            dedup=RotatingBloomFilter(max_bytes=4096),
+        )
+    assert checkpoint.dedup == f"{state}.dedup0"
+
+    builder = run_checkpointed(
+        tmp_path,
+        units,
+        Checkpoint(state),
+        resume=True,
+        db_uri=db_uri,
+        dedup=RotatingBloomFilter(max_bytes=4096),
+    )
+    assert len((tmp_path / "results.txt").read_text().splitlines()) == 2
+    assert builder.checkpoint.dedup == f"{state}.dedup1"
+
+    with pytest.raises(ValueError, match="other dedup settings"):
+        RotatingBloomFilter(max_bytes=8192).restore(builder.checkpoint.dedup)
@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import text
+
+from terms_of_interest import db
+from terms_of_interest.pipeline import MatchResult
+
+
+def count_results(dal, model=db.Results):
+    with dal.engine.connect() as conn:
+        return len(conn.execute(model.__table__.select()).fetchall())
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+def test_BulkWriter_writes_all_rows(threaded):
+    dal = db.DataAccessLayer().connect()
+    writer = db.BulkWriter(dal.engine, batch_size=3, threaded=threaded)
+
+    for idx in range(10):
+        writer.add(MatchResult("law", str(idx)))
+    assert len(writer.rows) == 1
+
+    writer.flush()
+    assert writer.written == 10
+    assert count_results(dal) == 10
+
+
+def test_BulkWriter_raises_write_errors():
+    dal = db.DataAccessLayer().connect()
+    writer = db.BulkWriter(dal.engine, threaded=True)
+
+    writer.add(MatchResult(None, "1"))
+    with pytest.raises(Exception):
+        writer.flush()
+
+
+def test_CompactBulkWriter_uses_terms_table():
+    dal = db.DataAccessLayer().connect()
+    writer = db.CompactBulkWriter(dal.engine, batch_size=2)
+
+    for idx, term in enumerate(["law", "felony", "law", "abortion", "felony"]):
+        writer.add(MatchResult(term, str(1115339928542564352 + idx), idx % 2 + 1))
+    writer.flush()
+
+    assert count_results(dal, db.CompactResults) == 5
+    assert count_results(dal, db.Terms) == 3
+    with dal.engine.connect() as conn:
+        rows = conn.execute(db.CompactResults.__table__.select()).fetchall()
+    assert {row.message_id for row in rows} == {
+        1115339928542564352 + idx for idx in range(5)
+    }
+    assert {row.unit for row in rows} == {1, 2}
+
+
+def test_DataAccessLayer_sqlite_pragmas(tmp_path):
+    dal = db.DataAccessLayer(
+        f"sqlite:///{tmp_path / 'results.db'}",
+        sqlite_pragmas={"journal_mode": "WAL", "synchronous": "NORMAL"},
+    ).connect()
+
+    with dal.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
@@ -0,0 +1,49 @@
+import random
+
+from terms_of_interest.dedup import RotatingBloomFilter
+
+
+def test_rotating_bloom_filter_adds():
+    seen = RotatingBloomFilter(max_bytes=4096, error_rate=1e-6)
+    ids = [1115339928542564352 + (idx << 22) for idx in range(100)]
+
+    assert not any(seen.add(message_id) for message_id in ids)
+    assert all(seen.add(message_id) for message_id in ids)
+    assert seen.duplicates == 100
+    assert ids[0] in seen and 1 not in seen
+
+
+def test_rotating_bloom_filter_bounded_memory():
+    seen = RotatingBloomFilter(max_bytes=4096, error_rate=1e-3, generations=4)
+    ids = [1115339928542564352 + (idx << 22) for idx in range(seen.capacity * 6)]
+    for message_id in ids:
+        seen.add(message_id)
+
+    assert len(seen.filters) == 4
+    assert seen.nbytes <= 4096
+    assert all(message_id in seen for message_id in ids[-seen.capacity * 3 :])
+    assert sum(message_id in seen for message_id in ids[: seen.capacity]) < 10
+
+
+def test_rotating_bloom_filter_error_rate():
+    seen = RotatingBloomFilter(max_bytes=64 * 1024, error_rate=1e-2)
+    rng = random.Random(0)
+    for _ in range(seen.capacity * 4):
+        seen.add(rng.getrandbits(63))
+
+    false_positives = sum(rng.getrandbits(63) in seen for _ in range(20000))
+    assert false_positives < 20000 * 1e-2 * 1.5
+
+
+def test_rotating_bloom_filter_save_restore(tmp_path):
+    seen = RotatingBloomFilter(max_bytes=4096, error_rate=1e-3, generations=4)
+    ids = [1115339928542564352 + (idx << 22) for idx in range(seen.capacity * 2)]
+    for message_id in ids:
+        seen.add(message_id)
+    seen.save(str(tmp_path / "seen.bin"))
+
+    restored = RotatingBloomFilter(max_bytes=4096, error_rate=1e-3, generations=4)
+    restored.restore(str(tmp_path / "seen.bin"))
+    assert list(restored.filters) == list(seen.filters)
+    assert restored.count == seen.count
+    assert all(message_id in restored for message_id in ids)
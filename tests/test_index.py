@@ -0,0 +1,75 @@
+from datetime import date
+
+from terms_of_interest import util
+from terms_of_interest.index import DateIndex, snowflake_timestamp
+
+
+tweet_template = """{{"text": "tweet", "node_id": "14511951", "message_id": "{message_id}", "message_time": "{message_time}"}}\n"""
+tweets = [
+    ("1115339928542564352", "Mon Apr 08 19:45:35 +0000 2019"),
+    ("1115342242041028610", "Mon Apr 08 19:54:47 +0000 2019"),
+    ("1116077164821143553", "Wed Apr 10 20:35:13 +0000 2019"),
+    ("1116190735336968192", "Thu Apr 11 04:06:31 +0000 2019"),
+]
+
+
+def write_tweets(tmp_path):
+    path = tmp_path / "tweets.jsonl"
+    path.write_text(
+        "".join(
+            tweet_template.format(message_id=message_id, message_time=message_time)
+            for message_id, message_time in tweets
+        )
+    )
+    return str(path)
+
+
+def test_snowflake_timestamp():
+    assert snowflake_timestamp("1115339928542564352") // 1000 == 1554752735
+
+
+def test_DateIndex_ranges(tmp_path):
+    path = write_tweets(tmp_path)
+    index = DateIndex.build(path).save()
+    loaded = DateIndex.load(path)
+
+    assert loaded.days == index.days
+    assert sorted(loaded.days) == ["2019-04-08", "2019-04-10", "2019-04-11"]
+    assert loaded.ranges(date(2019, 4, 9)) == []
+
+    lines = [
+        line
+        for start, end in loaded.ranges(date(2019, 4, 8))
+        for line in util.read_lines(path, start, end)
+    ]
+    assert [line.split('"message_id": "')[1][:19] for line in lines] == [
+        tweets[0][0],
+        tweets[1][0],
+    ]
+
+
+def test_DateIndex_stale(tmp_path):
+    path = write_tweets(tmp_path)
+    DateIndex.build(path).save()
+
+    with open(path, "a") as fd:
+        fd.write(tweet_template.format(message_id="1", message_time=tweets[0][1]))
+
+    assert DateIndex.load(path) is None
+
+
+def test_DateIndex_pre_snowflake_ids(tmp_path):
+    path = tmp_path / "tweets.jsonl"
+    path.write_text(
+        tweet_template.format(message_id="20", message_time=tweets[2][1])
+        + tweet_template.format(message_id=tweets[3][0], message_time=tweets[3][1])
+    )
+    index = DateIndex.build(str(path))
+
+    assert sorted(index.days) == ["2019-04-10", "2019-04-11"]
+    lines = [
+        line
+        for start, end in index.ranges(date(2019, 4, 10))
+        for line in util.read_lines(str(path), start, end)
+    ]
+    assert len(lines) == 1 and '"message_id": "20"' in lines[0]
@@ -1,3 +1,18 @@
+import pytest
+
+from terms_of_interest.cache import MatcherCache
+from terms_of_interest.matchers import (
+    ACMatcher,
+    CompiledACMatcher,
+    DoubleArrayACMatcher,
+    IntSetMatcher,
+    MemoMatcher,
+    UnitsACMatcher,
+    UnitsIntSetMatcher,
+    UnitsSetMatcher,
+)
+
+
 def test_node_matcher(node_matcher):
     matcher = node_matcher(["0123456"])
     assert "0123456" in matcher
@@ -8,6 +23,20 @@ def test_node_matcher_not_in_set(node_matcher):
     assert "0123456" not in matcher
 
 
+def test_int_set_matcher(tmp_path):
+    ids = [str(1115342224114495491 + step * 7919) for step in range(1000)]
+    for bloom_bits in (0, 10):
+        matcher = IntSetMatcher(bloom_bits=bloom_bits).add_terms(ids).build()
+        matcher.save(tmp_path / "nodes.toim")
+        loaded = IntSetMatcher.load(tmp_path / "nodes.toim")
+
+        items = ids[::3] + ["1234", "", "not an id", None, int(ids[1]), ids[0]]
+        expected = [item in ids or str(item) in ids for item in items]
+        for m in (matcher, loaded):
+            assert [item in m for item in items] == expected
+            assert m.contains_many(items) == expected
+
+
 def test_term_matchers(term_matchers):
     for matcher in term_matchers(["reminder", "espn+"]):
         results = matcher.query(
@@ -51,3 +80,177 @@ def test_term_matchers_overlap(term_matchers):
             "red sox",
             "home opener tickets",
         }
+
+
+def test_term_matchers_follow_fail_chain(term_matchers):
+    for matcher in term_matchers(["a b c d", "b c e", "c e", "e"]):
+        assert matcher.query("x a b c e") == {"b c e", "c e", "e"}
+    for matcher in term_matchers(["a", "a a", "b", "b b"]):
+        assert matcher.query("b b b a a") == {"a", "a a", "b", "b b"}
+
+
+def test_term_matchers_query_many(term_matchers):
+    texts = ["the red sox", "nothing here", "", "red sox and white sox tickets"]
+    texts.append(texts[0])
+    for matcher in term_matchers(["red sox", "white sox", "tickets"]):
+        results = matcher.query_many(texts)
+        assert sorted(results) == sorted(
+            (idx, term) for idx, text in enumerate(texts) for term in matcher.query(text)
+        )
+        assert [idx for idx, _ in results] == [0, 3, 3, 3, 4]
+
+
+def test_units_userset_matchers(tmp_path):
+    usersets = [["1", "2", "3"], ["3", "4"], [], ["1", "4", "5"]]
+    items = ["1", "2", "3", "4", "5", "6", "not an id", None]
+    expected = [0b1001, 0b0001, 0b0011, 0b1010, 0b1000, 0, 0, 0]
+    for cls in (UnitsSetMatcher, UnitsIntSetMatcher):
+        matcher = cls()
+        for unit, userset in enumerate(usersets):
+            matcher.add_terms(userset, unit=unit)
+        matchers = [matcher.build()]
+        if hasattr(cls, "load"):
+            matcher.save(tmp_path / "units.toim")
+            matchers.append(cls.load(tmp_path / "units.toim"))
+
+        for m in matchers:
+            assert [m.units(item) for item in items] == expected
+            assert m.units_many(items) == expected
+            assert m.contains_many(items) == [bool(mask) for mask in expected]
+
+
+def test_units_matcher_masks():
+    matcher = UnitsACMatcher()
+    matcher.add_terms(["red sox", "tickets"], unit=0)
+    matcher.add_terms(["tickets", "white sox"], unit=1)
+    matcher.build()
+
+    text = "red sox and white sox tickets"
+    assert matcher.query(text) == {"red sox", "white sox", "tickets"}
+    assert matcher.query_units(text) == {"red sox": 1, "white sox": 2, "tickets": 3}
+    assert matcher.query_units(text, units=2) == {"white sox": 2, "tickets": 2}
+
+
+def test_memo_matchers(term_matchers):
+    texts = ["Red Sox tickets", "red sox TICKETS", "white sox", "Red Sox tickets"]
+    for matcher in term_matchers(["red sox", "tickets", "white sox"]):
+        memo = MemoMatcher(matcher, capacity=2)
+        assert [memo.query(text) for text in texts] == [
+            matcher.query(text) for text in texts
+        ]
+        assert memo.cache_counts() == (2, 2)
+        assert memo.cached_query.cache_info().currsize == 2
+        assert memo.tokenizer is matcher.tokenizer
+
+        assert memo.drain_counters() == (2, 2)
+        assert memo.cache_counts() == (0, 0)
+        memo.merge_counters((2, 1))
+        assert memo.cache_counts() == (2, 1)
+
+
+def test_memo_units_matcher():
+    matcher = UnitsACMatcher()
+    matcher.add_terms(["red sox", "tickets"], unit=0)
+    matcher.add_terms(["tickets", "white sox"], unit=1)
+    memo = MemoMatcher(matcher.build())
+
+    text = "red sox and white sox tickets"
+    assert memo.query_units(text) == {"red sox": 1, "white sox": 2, "tickets": 3}
+    assert memo.query_units(text.upper(), units=2) == {"white sox": 2, "tickets": 2}
+    assert memo.cache_counts() == (1, 1)
+
+
+def test_compiled_matchers_save_load(tmp_path):
+    matcher = UnitsACMatcher()
+    matcher.add_terms(["red sox", "tickets", "sox home opener"], unit=0)
+    matcher.add_terms(["tickets", "white sox"], unit=1)
+    matcher.build().save(tmp_path / "units.toim")
+    loaded = UnitsACMatcher.load(tmp_path / "units.toim")
+
+    texts = ["red sox and white sox tickets", "the sox home opener", "nothing"]
+    for text in texts:
+        assert loaded.query_units(text) == matcher.query_units(text)
+    assert loaded.query_many(texts) == matcher.query_many(texts)
+
+    with pytest.raises(ValueError):
+        CompiledACMatcher.load(tmp_path / "units.toim")
+
+
+def test_double_array_matcher_matches_ac_matcher(tmp_path):
+    words = [f"w{idx}" for idx in range(40)]
+    terms = {
+        " ".join(words[(idx * step) % 40] for step in range(1, idx % 4 + 2))
+        for idx in range(200)
+    }
+    texts = [
+        " ".join(words[(idx * idx + step * 7) % 40] for step in range(12))
+        for idx in range(100)
+    ] + ["", "not in vocab w1 w2 w3", "W1 w2 W3"]
+    expected = ACMatcher().add_terms(terms).build()
+    matcher = DoubleArrayACMatcher().add_terms(terms).build()
+    matcher.save(tmp_path / "terms.toim")
+    loaded = DoubleArrayACMatcher.load(tmp_path / "terms.toim")
+
+    for m in (matcher, loaded):
+        assert [m.query(text) for text in texts] == [
+            expected.query(text) for text in texts
+        ]
+        assert sorted(m.query_many(texts)) == sorted(expected.query_many(texts))
+    assert len(matcher.check) < 2 * sum(len(term.split()) for term in terms)
+
+
+def test_matcher_cache(tmp_path):
+    terms_path = tmp_path / "terms.txt"
+    terms_path.write_text("red sox\ntickets\n")
+    cache = MatcherCache(tmp_path / "cache")
+
+    built = cache.from_txtfile(CompiledACMatcher, terms_path)
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+    cached = cache.from_txtfile(CompiledACMatcher, terms_path)
+    assert isinstance(cached.fail, memoryview)
+    assert cached.query("red sox tickets") == built.query("red sox tickets")
+
+    terms_path.write_text("white sox\n")
+    changed = cache.from_txtfile(CompiledACMatcher, terms_path)
+    assert changed.query("red sox and white sox") == {"white sox"}
+    assert len(list((tmp_path / "cache").iterdir())) == 2
+
+
+def test_ac_matcher_incremental_updates():
+    matcher = ACMatcher().add_terms(["red sox", "sox home opener", "tickets"]).build()
+    assert matcher.word_parents is None
+    matcher.add_terms(["home opener", "red sox home opener tickets"])
+    assert sorted(matcher.word_parents["opener"].values()) == [1, 2, 3]
+    matcher.remove_terms(["tickets", "sox home opener", "not a term"])
+
+    terms = ["red sox", "home opener", "red sox home opener tickets"]
+    rebuilt = ACMatcher().add_terms(terms).build()
+    for text in [
+        "the red sox home opener tickets",
+        "red sox home opener",
+        "sox home opener tickets",
+    ]:
+        assert matcher.query(text) == rebuilt.query(text)
+    assert matcher.query("red sox home opener tickets") == set(terms)
+    assert "sox" not in matcher.root.children
+
+
+def test_ac_matcher_save_load(tmp_path):
+    terms = ["red sox", "sox home opener", "tickets", "home opener", "sox"]
+    matcher = ACMatcher().add_terms(terms).build()
+    matcher.save(tmp_path / "ac.toim")
+    loaded = ACMatcher.load(tmp_path / "ac.toim")
+
+    texts = ["the red sox home opener tickets", "sox home", "nothing", ""]
+    assert [loaded.query(text) for text in texts] == [
+        matcher.query(text) for text in texts
+    ]
+    loaded.add_terms(["white sox"]).remove_terms(["sox"])
+    assert loaded.query("red sox and white sox") == {"red sox", "white sox"}
+
+    cache = MatcherCache(tmp_path / "cache")
+    (tmp_path / "terms.txt").write_text("\n".join(terms))
+    cache.from_txtfile(ACMatcher, tmp_path / "terms.txt")
+    cached = cache.from_txtfile(ACMatcher, tmp_path / "terms.txt")
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+    assert cached.query(texts[0]) == matcher.query(texts[0])
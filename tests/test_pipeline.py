@@ -2,9 +2,29 @@ from datetime import date, datetime
 
 from glide import Glider, Return
 
-from terms_of_interest.pipeline import SchemaLoad, DateFilter, UserFilter, TermFilter
-from terms_of_interest.schemas import Tweet
-from terms_of_interest.matchers import ACMatcher
+from terms_of_interest.pipeline import (
+    PipelineBuilder,
+    PreFilter,
+    SchemaLoad,
+    DateFilter,
+    UserFilter,
+    TermFilter,
+    UnitsFilter,
+    UnitsTermFilter,
+    BatchPreFilter,
+    BatchTermFilter,
+    BatchUnitsFilter,
+    BatchUnitsTermFilter,
+)
+from terms_of_interest.dedup import RotatingBloomFilter
+from terms_of_interest.schemas import Tweet, FastTweet
+from terms_of_interest.matchers import (
+    ACMatcher,
+    SetMatcher,
+    UnitsACMatcher,
+    UnitsSetMatcher,
+)
+from terms_of_interest.stats import PipelineStats
 
 
 tweet_raw = """{"text": "Florida lawmakers have introduced a law that requires physicians to obtain a parent or guardian's notarized written consent before a minor child can have an abortion. Doctors who violate the law could be charged with a felony. https://t.co/FsIletsEHV", "node_id": "14511951", "message_id": "1115339928542564352", "message_time": "Mon Apr 08 19:45:35 +0000 2019"}"""
@@ -29,6 +49,14 @@ def test_SchemaLoad():
     assert isinstance(result[0].message_time, datetime)
 
 
+def test_SchemaLoad_fast():
+    node = SchemaLoad("schema", schema=FastTweet)
+    result = build_test_pipeline(node, tweet_raw)
+
+    assert len(result) == 1
+    assert result[0].message_time == tweet_obj.message_time
+
+
 def test_DateFilter_default():
     node = DateFilter("date_filter")
     result = build_test_pipeline(node, tweet_raw)
@@ -81,3 +109,342 @@ def test_TermFilter_not_in_termset():
     results = build_test_pipeline(node, tweet_obj)
 
     assert len(results) == 0
+
+
+def build_units_node(units):
+    termset = UnitsACMatcher()
+    for unit, terms in enumerate(units):
+        termset.add_terms(terms, unit=unit)
+    return termset.build()
+
+
+def build_units_userset(usersets):
+    userset = UnitsSetMatcher()
+    for unit, node_ids in enumerate(usersets):
+        userset.add_terms(node_ids, unit=unit)
+    return userset.build()
+
+
+def test_UnitsFilter_routes_matches_to_units():
+    termset = build_units_node([{"florida lawmakers", "law"}, {"law", "charged"}])
+    node = UnitsFilter(
+        "units",
+        userset=build_units_userset([{"14511951"}, {"14511951"}]),
+        termset=termset,
+    )
+    results = build_test_pipeline(node, tweet_obj)
+
+    assert sorted(r.term for r in results) == sorted(
+        ["florida lawmakers", "law", "law", "charged"]
+    )
+
+
+def test_UnitsFilter_skips_other_units():
+    termset = build_units_node([{"florida lawmakers", "law"}, {"charged"}])
+    node = UnitsFilter(
+        "units",
+        userset=build_units_userset([{"1234"}, {"14511951"}]),
+        termset=termset,
+    )
+    results = build_test_pipeline(node, tweet_obj)
+
+    assert [r.term for r in results] == ["charged"]
+
+
+def test_UnitsFilter_not_in_usersets():
+    termset = build_units_node([{"law"}, {"charged"}])
+    node = UnitsFilter(
+        "units",
+        userset=build_units_userset([{"1234"}, {"5678"}]),
+        termset=termset,
+    )
+    results = build_test_pipeline(node, tweet_obj)
+
+    assert len(results) == 0
+
+
+def test_UnitsTermFilter_routes_to_unit_termsets():
+    termsets = [
+        ACMatcher().add_terms(terms).build()
+        for terms in ({"florida lawmakers"}, {"law"}, {"charged"})
+    ]
+    userset = build_units_userset([{"14511951"}, {"1234"}, {"14511951"}])
+    node = UnitsTermFilter("units", userset=userset, termsets=termsets)
+    results = build_test_pipeline(node, tweet_obj)
+
+    assert [(r.term, r.unit) for r in results] == [
+        ("florida lawmakers", 1),
+        ("charged", 3),
+    ]
+
+
+def test_BatchUnitsTermFilter_matches_UnitsTermFilter():
+    termsets = [
+        ACMatcher().add_terms(terms).build()
+        for terms in ({"florida lawmakers", "law"}, {"law"}, {"charged"})
+    ]
+    userset = build_units_userset([{"14511951", "1"}, {"1234"}, {"14511951"}])
+    other_obj = tweet_obj.copy(update=dict(node_id="1", message_id="1"))
+    tweets = [tweet_obj, other_obj]
+    expected = [
+        result
+        for tweet in tweets
+        for result in build_test_pipeline(
+            UnitsTermFilter("units", userset=userset, termsets=termsets), tweet
+        )
+    ]
+    node = BatchUnitsTermFilter("units", userset=userset, termsets=termsets)
+    (results,) = build_test_pipeline(node, tweets)
+
+    assert results == expected
+
+
+def test_BatchTermFilter_matches_TermFilter():
+    terms = {"florida lawmakers", "lawmakers", "law", "charged"}
+    termset = ACMatcher().add_terms(terms).build()
+    other_obj = tweet_obj.copy(update=dict(text="nothing to see", message_id="1"))
+    tweets = [tweet_obj, other_obj, tweet_obj]
+    expected = [
+        result
+        for tweet in tweets
+        for result in build_test_pipeline(
+            TermFilter("term_filter", termset=termset, unit=1), tweet
+        )
+    ]
+    node = BatchTermFilter("term_filter", termset=termset, unit=1)
+    (results,) = build_test_pipeline(node, tweets)
+
+    assert results == expected
+
+
+def test_BatchUnitsFilter_routes_matches_to_units():
+    termset = build_units_node([{"florida lawmakers", "law"}, {"charged"}])
+    userset = build_units_userset([{"1234"}, {"14511951"}])
+    node = BatchUnitsFilter("units", userset=userset, termset=termset)
+    (results,) = build_test_pipeline(node, [tweet_obj, tweet_obj])
+
+    assert [(r.term, r.unit) for r in results] == [("charged", 2), ("charged", 2)]
+
+
+def test_BatchPreFilter_drops_lines():
+    other_raw = tweet_raw.replace("14511951", "1234")
+    nodes = SetMatcher().add_terms(["14511951"])
+
+    def build_node():
+        return BatchPreFilter("prefilter", nodes=nodes, execution_date=date(2019, 4, 8))
+
+    results = build_test_pipeline(build_node(), [tweet_raw, other_raw, "{}"])
+    assert results == [[tweet_raw, "{}"]]
+    assert build_test_pipeline(build_node(), [other_raw]) == []
+
+
+def build_test_units(tmp_path):
+    (tmp_path / "nodes.txt").write_text("14511951\n")
+    (tmp_path / "terms.txt").write_text("law\nlawmakers\n")
+    (tmp_path / "tweets.jsonl").write_text(f"{tweet_raw}\n" * 50)
+    return [dict(userset=tmp_path / "nodes.txt", termset=tmp_path / "terms.txt")]
+
+
+def test_PipelineBuilder_run_sharded(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    data = [str(tmp_path / "tweets.jsonl")]
+    builder = PipelineBuilder(units=units).build().set_context()
+
+    builder.run(data)
+    expected = capsys.readouterr().out
+    builder.run(data, workers=3, ordered=True)
+    results = capsys.readouterr().out
+
+    assert len(results.splitlines()) == 100
+    assert results == expected
+
+
+def test_PipelineBuilder_run_intset_usersets(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    data = [str(tmp_path / "tweets.jsonl")]
+    PipelineBuilder(units=units).build().set_context().run(data)
+    expected = capsys.readouterr().out
+    PipelineBuilder(units=units).build().set_context(userset_algo="IntSet").run(data)
+
+    assert capsys.readouterr().out == expected
+
+
+def test_PipelineBuilder_run_many_units(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    (tmp_path / "other_nodes.txt").write_text("1234\n")
+    (tmp_path / "other_terms.txt").write_text("florida\nlaw\n")
+    units += [
+        dict(userset=tmp_path / "other_nodes.txt", termset=units[0]["termset"]),
+        dict(userset=units[0]["userset"], termset=tmp_path / "other_terms.txt"),
+    ] * 10
+    data = [str(tmp_path / "tweets.jsonl")]
+
+    expected = []
+    for userset_algo in ("Set", "IntSet"):
+        for merge_units in (False, True):
+            builder = PipelineBuilder(units=units, merge_units=merge_units).build()
+            builder.set_context(
+                format_template="{r.term}, {r.unit}", userset_algo=userset_algo
+            ).run(data)
+            results = sorted(set(capsys.readouterr().out.splitlines()))
+            expected = expected or results
+            assert results == expected
+
+    assert expected == sorted(
+        ["law, 1", "lawmakers, 1"]
+        + [f"{term}, {unit}" for unit in range(3, 22, 2) for term in ("florida", "law")]
+    )
+
+
+def test_PipelineBuilder_run_stream(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    path = tmp_path / "tweets.jsonl"
+    PipelineBuilder(units=units).build().set_context().run([str(path)])
+    expected = capsys.readouterr().out
+
+    builder = PipelineBuilder(units=units).build(stream=True).set_context()
+    with open(path, "rb") as fd:
+        builder.run_stream(fd, batch_size=7)
+
+    assert capsys.readouterr().out == expected
+
+
+def test_PipelineBuilder_run_dedup(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    tweets = tmp_path / "tweets.jsonl"
+    other_raw = tweet_raw.replace("1115339928542564352", "1115339928542564353")
+    (tmp_path / "other.jsonl").write_text(f"{other_raw}\n{tweet_raw}\n")
+    data = [str(tweets), str(tmp_path / "other.jsonl")]
+
+    builder = PipelineBuilder(units=units, dedup=RotatingBloomFilter(max_bytes=4096))
+    builder.build().set_context().run(data)
+    assert len(capsys.readouterr().out.splitlines()) == 4
+    assert builder.dedup.duplicates == 50
+
+    builder = PipelineBuilder(units=units, dedup=RotatingBloomFilter(max_bytes=4096))
+    builder.build().set_context().run(data, workers=2)
+    assert len(capsys.readouterr().out.splitlines()) == 4
+    assert builder.dedup.max_bytes == 4096 // 3
+    assert builder.dedup.duplicates == 50
+
+
+def test_PipelineBuilder_run_match_cache(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    data = [str(tmp_path / "tweets.jsonl")]
+    PipelineBuilder(units=units).build().set_context().run(data)
+    expected = capsys.readouterr().out
+
+    builder = PipelineBuilder(units=units, match_cache_size=16)
+    builder.build().set_context().run(data, workers=2)
+    assert capsys.readouterr().out == expected
+    termset = builder.match_caches()["terms1"]
+    assert termset.cache_counts() == (48, 2)
+
+
+def test_PipelineBuilder_run_batch(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    data = [str(tmp_path / "tweets.jsonl")]
+    PipelineBuilder(units=units).build().set_context().run(data)
+    expected = capsys.readouterr().out
+
+    stats = PipelineStats()
+    builder = PipelineBuilder(units=units, batch=True, chunk_size=4096, stats=stats)
+    builder.build().set_context().run(data)
+    assert capsys.readouterr().out == expected
+    nodes = stats.to_dict()["nodes"]
+    assert nodes["prefilter"]["items_in"] == 50
+    assert nodes["output"]["items_in"] == 100
+
+    builder.run(data, workers=3)
+    assert sorted(capsys.readouterr().out.splitlines()) == sorted(
+        expected.splitlines()
+    )
+
+    builder = PipelineBuilder(units=units, batch=True).build(stream=True).set_context()
+    with open(data[0], "rb") as fd:
+        builder.run_stream(fd, batch_size=7)
+    assert capsys.readouterr().out == expected
+
+
+def test_PipelineBuilder_run_batch_merge_units(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    data = [str(tmp_path / "tweets.jsonl")]
+    PipelineBuilder(units=units, merge_units=True).build().set_context().run(data)
+    expected = capsys.readouterr().out
+
+    builder = PipelineBuilder(units=units, merge_units=True, batch=True)
+    builder.build().set_context().run(data)
+    assert capsys.readouterr().out == expected
+
+
+def test_PreFilter_in_nodes():
+    node = PreFilter("prefilter", nodes={"14511951"})
+    result = build_test_pipeline(node, tweet_raw)
+
+    assert result == [tweet_raw]
+
+
+def test_PreFilter_not_in_nodes():
+    node = PreFilter("prefilter", nodes={"1234"})
+    result = build_test_pipeline(node, tweet_raw)
+
+    assert len(result) == 0
+
+
+def test_PreFilter_with_other_execution_date():
+    node = PreFilter("prefilter", execution_date=date(2019, 4, 9))
+    result = build_test_pipeline(node, tweet_raw)
+
+    assert len(result) == 0
+
+
+def test_PreFilter_with_same_execution_date():
+    node = PreFilter("prefilter", execution_date=date(2019, 4, 8))
+    result = build_test_pipeline(node, tweet_raw)
+
+    assert len(result) == 1
+
+
+def test_PreFilter_passes_pre_snowflake_ids():
+    old_raw = tweet_raw.replace("1115339928542564352", "20")
+    node = PreFilter("prefilter", execution_date=date(2019, 4, 9))
+    assert build_test_pipeline(node, old_raw) == [old_raw]
+
+    node = BatchPreFilter("prefilter", execution_date=date(2019, 4, 9))
+    assert build_test_pipeline(node, [old_raw, tweet_raw]) == [[old_raw]]
+
+    execution_date = date(2019, 4, 8)
+    glider = Glider(
+        PreFilter("prefilter", execution_date=execution_date)
+        | SchemaLoad("schema", schema=Tweet)
+        | DateFilter("date_filter", execution_date=execution_date)
+        | Return("return")
+    )
+    results = glider.consume([old_raw])
+    assert [tweet.message_id for tweet in results] == ["20"]
+
+
+def test_PipelineBuilder_run_stats(tmp_path, capsys):
+    units = build_test_units(tmp_path)
+    data = [str(tmp_path / "tweets.jsonl")]
+    stats = PipelineStats()
+    PipelineBuilder(units=units, stats=stats).build().set_context().run(data)
+    capsys.readouterr()
+
+    nodes = stats.to_dict()["nodes"]
+    assert nodes["extract"]["items_out"] == 50
+    assert nodes["prefilter"]["items_in"] == 50
+    assert nodes["units"]["items_in"] == 50
+    assert nodes["units"]["items_out"] == 100
+    assert nodes["output"]["items_in"] == 100
+    assert all(node["self_s"] <= node["total_s"] for node in nodes.values())
+    assert 'toi_node_items_in_total{node="output"} 100' in stats.to_prometheus()
+
+    stats.write(tmp_path / "stats.json")
+    assert "samples" in (tmp_path / "stats.json").read_text()
+
+
+def test_PipelineBuilder_without_stats_leaves_nodes():
+    builder = PipelineBuilder().build()
+    for node in builder.pipeline.get_node_lookup().values():
+        assert "process" not in vars(node)
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import pytest
+
+from terms_of_interest.schemas import Tweet, FastTweet, parse_timestamp
+
+
+tweet_raw = """{"text": "Baseball is back", "node_id": "14511951", "message_id": "1115339928542564352", "message_time": "Mon Apr 08 19:45:35 +0000 2019"}"""
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "Mon Apr 08 19:45:35 +0000 2019",
+        "Wed Dec 31 23:59:59 -0530 2008",
+        "Sat Feb 29 00:00:00 +1200 2020",
+    ],
+)
+def test_parse_timestamp(value):
+    assert parse_timestamp(value) == datetime.strptime(value, "%a %b %d %H:%M:%S %z %Y")
+
+
+def test_FastTweet_matches_Tweet():
+    fast, strict = FastTweet.parse_raw(tweet_raw), Tweet.parse_raw(tweet_raw)
+
+    for field in ("text", "node_id", "message_id", "message_time"):
+        assert getattr(fast, field) == getattr(strict, field)
+
+
+def test_FastTweet_missing_field():
+    with pytest.raises(ValueError):
+        FastTweet.parse_raw('{"text": "no ids"}')
+
+
+def test_FastTweet_numeric_ids():
+    raw = tweet_raw.replace('"14511951"', "14511951").replace(
+        '"1115339928542564352"', "1115339928542564352"
+    )
+    fast, strict = FastTweet.parse_raw(raw), Tweet.parse_raw(raw)
+
+    assert fast.node_id == strict.node_id == "14511951"
+    assert fast.message_id == strict.message_id == "1115339928542564352"
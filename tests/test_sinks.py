@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone
+import csv
+import os
+import sys
+
+import pytest
+import ujson
+
+from terms_of_interest.pipeline import MatchResult
+from terms_of_interest.sinks import (
+    CSVSink,
+    JSONLSink,
+    ParquetSink,
+    TextSink,
+    compile_template,
+    open_sink,
+    result_day,
+)
+
+
+results = [
+    MatchResult("abortion", "1115339928542564352", 1),
+    MatchResult("law", "1115339928542564352", 2),
+    MatchResult("50% off", "1118000000000000000", 1),
+]
+
+
+@pytest.mark.parametrize(
+    "template",
+    [
+        "{r.term}, {r.message_id}",
+        "{r.unit}|{r.term}",
+        "100% {r.term}",
+        "{{r.term}} {r.term}",
+        "{r.term!r:>12} {r.unit:03d}",
+        "{r[0]} {r.message_id}",
+        "no fields",
+    ],
+)
+def test_compile_template(template):
+    format_result = compile_template(template)
+    for result in results:
+        assert format_result(result) == template.format(r=result)
+
+
+def test_text_sink(tmp_path, capsys):
+    path = tmp_path / "out" / "results.txt"
+    sink = TextSink(str(path), buffer_rows=2)
+    for result in results:
+        sink.write(result)
+    assert len(sink.rows) == 1
+    sink.close()
+    assert path.read_text().splitlines() == [
+        "abortion, 1115339928542564352",
+        "law, 1115339928542564352",
+        "50% off, 1118000000000000000",
+    ]
+
+    sink = TextSink(template="{r.unit} {r.term}")
+    for result in results:
+        sink.write(result)
+    sink.close()
+    assert capsys.readouterr().out == "1 abortion\n2 law\n1 50% off\n"
+
+
+def test_jsonl_and_csv_sinks(tmp_path):
+    jsonl_path, csv_path = tmp_path / "results.jsonl", tmp_path / "results.csv"
+    for sink in (JSONLSink(str(jsonl_path)), CSVSink(str(csv_path))):
+        for result in results:
+            sink.write(result)
+        sink.close()
+
+    with open(jsonl_path) as fd:
+        rows = [ujson.loads(line) for line in fd]
+    assert rows[0] == dict(term="abortion", message_id="1115339928542564352", unit=1)
+    with open(csv_path, newline="") as fd:
+        rows = list(csv.reader(fd))
+    assert rows[0] == ["term", "message_id", "unit"]
+    assert rows[1:] == [
+        [term, message_id, str(unit)] for term, message_id, unit, _ in results
+    ]
+
+
+def test_partitioned_sink(tmp_path):
+    sink = open_sink("csv", str(tmp_path / "by_unit"), partition_by="unit")
+    for result in results:
+        sink.write(result)
+    sink.close()
+    assert sorted(os.listdir(tmp_path / "by_unit")) == ["unit=1", "unit=2"]
+    with open(tmp_path / "by_unit" / "unit=1" / "results.csv", newline="") as fd:
+        assert len(list(csv.reader(fd))) == 3
+
+    assert result_day(results[0]) == "2019-04-08"
+    sink = open_sink("jsonl", str(tmp_path / "by_day"), partition_by="day")
+    for result in results:
+        sink.write(result)
+    sink.close()
+    assert sorted(os.listdir(tmp_path / "by_day")) == ["day=2019-04-08", "day=2019-04-16"]
+
+    with pytest.raises(ValueError):
+        open_sink("text", partition_by="unit")
+    with pytest.raises(ValueError):
+        open_sink("parquet")
+
+
+def test_result_day_pre_snowflake_ids():
+    message_time = datetime(2009, 5, 1, 23, 30, tzinfo=timezone(timedelta(hours=-5)))
+    assert result_day(MatchResult("law", "20", 1, message_time)) == "2009-05-02"
+    assert result_day(results[0]._replace(message_time=message_time)) == "2019-04-08"
+
+
+def test_parquet_sink(tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "results.parquet"
+    sink = ParquetSink(str(path), buffer_rows=2)
+    for result in results:
+        sink.write(result)
+    sink.close()
+
+    parquet_file = parquet.ParquetFile(str(path))
+    assert parquet_file.num_row_groups == 2
+    table = parquet_file.read()
+    assert table.column_names == ["term", "message_id", "unit"]
+    assert table.column("message_id").to_pylist()[-1] == 1118000000000000000
+    assert table.column("unit").to_pylist() == [1, 2, 1]
+
+
+def test_parquet_sink_without_pyarrow(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(RuntimeError, match="pyarrow"):
+        ParquetSink(str(tmp_path / "results.parquet"))
+    with pytest.raises(RuntimeError, match="pyarrow"):
+        open_sink("parquet", str(tmp_path / "by_unit"), partition_by="unit")
+
+
+def test_sink_positions_absolute(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sink = TextSink("out.txt")
+    sink.write_many(results)
+    positions = sink.positions()
+    sink.write(results[0])
+    sink.close()
+    assert list(positions) == [str(tmp_path / "out.txt")]
+
+    (tmp_path / "other").mkdir()
+    monkeypatch.chdir(tmp_path / "other")
+    sink = TextSink("../out.txt")
+    sink.restore(positions)
+    sink.close()
+    assert len((tmp_path / "out.txt").read_text().splitlines()) == 3
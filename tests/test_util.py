@@ -0,0 +1,155 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import time
+
+import pytest
+
+from terms_of_interest import util
+
+
+def write_lines(path, lines):
+    path.write_text("".join(f"{line}\n" for line in lines))
+    return str(path)
+
+
+def test_split_file_is_newline_aligned(tmp_path):
+    lines = [f"line {idx}" * (idx % 7 + 1) for idx in range(100)]
+    path = write_lines(tmp_path / "lines.txt", lines)
+
+    shards = util.split_file(path, 8)
+
+    assert len(shards) == 8
+    assert [line for shard in shards for line in util.read_lines(*shard)] == lines
+
+
+def test_split_file_more_shards_than_lines(tmp_path):
+    path = write_lines(tmp_path / "lines.txt", ["a", "b"])
+
+    shards = util.split_file(path, 10)
+
+    assert [line for shard in shards for line in util.read_lines(*shard)] == ["a", "b"]
+
+
+def test_split_files_whole_files(tmp_path):
+    paths = [write_lines(tmp_path / f"{idx}.txt", ["a", "b"]) for idx in range(3)]
+
+    shards = util.split_files(paths, 2)
+
+    assert [shard[0] for shard in shards] == paths
+
+
+def test_read_chunks_are_newline_aligned(tmp_path):
+    lines = [f"line {idx}" * (idx % 5 + 1) for idx in range(50)]
+    path = write_lines(tmp_path / "lines.txt", lines)
+
+    chunks = list(util.read_chunks(path, chunk_size=64))
+
+    assert len(chunks) > 1
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+    assert b"".join(chunks).decode().splitlines() == lines
+
+
+def test_read_lines_long_lines_and_no_trailing_newline(tmp_path):
+    path = tmp_path / "lines.txt"
+    path.write_text("x" * 100 + "\n\nshort\nlast")
+
+    assert list(util.read_lines(str(path), chunk_size=16)) == ["x" * 100, "short", "last"]
+
+
+def test_read_lines_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_text("")
+
+    assert list(util.read_lines(str(path))) == []
+
+
+@pytest.mark.parametrize(
+    "suffix,open_func",
+    [(".gz", gzip.open), (".bz2", bz2.open), (".xz", lzma.open), ("", gzip.open)],
+)
+def test_read_lines_compressed(tmp_path, suffix, open_func):
+    lines = [f"line {idx}" * (idx % 5 + 1) for idx in range(500)]
+    path = str(tmp_path / f"lines.txt{suffix}")
+    with open_func(path, "wt") as fd:
+        fd.write("".join(f"{line}\n" for line in lines))
+
+    assert util.detect_compression(path) == (suffix[1:] or "gz")
+    assert list(util.read_lines(path, chunk_size=100)) == lines
+    assert util.split_files([path], 4) == [(path, 0, os.path.getsize(path))]
+
+
+def test_read_lines_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = str(tmp_path / "lines.txt.zst")
+    with open(path, "wb") as fd:
+        fd.write(zstandard.ZstdCompressor().compress(b"a\nb\nc"))
+
+    assert list(util.read_lines(path)) == ["a", "b", "c"]
+
+
+def test_read_stream_batches():
+    lines = [f"line {idx}" * (idx % 5 + 1) for idx in range(500)]
+    fd = io.BytesIO("".join(f"{line}\n" for line in lines).encode())
+    batches = list(util.read_stream(fd, batch_size=7, chunk_size=100))
+
+    assert all(0 < len(batch) <= 7 for batch in batches)
+    assert [line for batch in batches for line in batch] == lines
+
+
+def test_read_stream_yields_lines_as_they_arrive():
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, "rb") as fd:
+        batches = util.read_stream(fd, batch_size=1000)
+        os.write(write_fd, b"a\nb\nc")
+        assert next(batches) == ["a", "b"]
+        os.write(write_fd, b"d\n")
+        os.close(write_fd)
+        assert list(batches) == [["cd"]]
+
+
+def test_read_stream_reads_ahead_at_most_queue_size_batches():
+    class Endless:
+        reads = 0
+
+        def read(self, size):
+            self.reads += 1
+            return b"line\n" * 10
+
+    fd = Endless()
+    batches = util.read_stream(fd, batch_size=10, queue_size=2)
+    next(batches)
+    time.sleep(0.2)
+
+    assert fd.reads <= 4
+    batches.close()
+
+
+def test_read_units(tmp_path):
+    (tmp_path / "nodes.txt").write_text("1\n")
+    (tmp_path / "terms.txt").write_text("law\n")
+    config = tmp_path / "units.json"
+    config.write_text(
+        '{"units": [{"userset": "nodes.txt", "termset": "terms.txt"},'
+        ' {"userset": "nodes.txt", "termset": "%s"}]}' % (tmp_path / "terms.txt")
+    )
+    unit = dict(userset=str(tmp_path / "nodes.txt"), termset=str(tmp_path / "terms.txt"))
+    assert util.read_units(str(config)) == [unit, unit]
+
+    for content in ('{"units": []}', '[{"userset": "nodes.txt"}]', '{"units": [1]}'):
+        config.write_text(content)
+        with pytest.raises(ValueError):
+            util.read_units(str(config))
+
+    config.write_text('{"units": [{"userset": "missing.txt", "termset": "terms.txt"}]}')
+    with pytest.raises(ValueError, match="does not exist"):
+        util.read_units(str(config))
+
+    config.write_text(
+        '{"units": [%s]}'
+        % ", ".join(['{"userset": "nodes.txt", "termset": "terms.txt"}'] * 65)
+    )
+    with pytest.raises(ValueError, match="at most 64"):
+        util.read_units(str(config))
@@ -0,0 +1,40 @@
+import io
+
+import ujson
+
+from terms_of_interest.tools.verify import ResultsVerifier
+
+
+def write_tweets(tmp_path):
+    tweets = [
+        dict(
+            text=f"Tweet {idx} about the Red Sox",
+            node_id="14511951",
+            message_id=str(1115339928542564352 + idx),
+            message_time="Mon Apr 08 19:45:35 +0000 2019",
+        )
+        for idx in range(200)
+    ]
+    path = tmp_path / "tweets.jsonl"
+    path.write_text("".join(f"{ujson.dumps(tweet)}\n" for tweet in tweets))
+    return str(path)
+
+
+def test_verifier_streams_referenced_messages(tmp_path, capsys):
+    data = write_tweets(tmp_path)
+    results = io.StringIO(
+        "red sox, 1115339928542564352\n"
+        "white sox, 1115339928542564360\n"
+        "tweet 150, 1115339928542564502\n"
+        "red sox, 1234\n"
+    )
+    for workers in (1, 3):
+        results.seek(0)
+        ResultsVerifier(workers=workers, shard_size=1024).run(data, results)
+        out = capsys.readouterr().out.splitlines()
+        assert out == [
+            "[!] Line: 1 Term: 'white sox' not found in message_id: '1115339928542564360'",
+            "    Message Text: 'tweet 8 about the red sox'",
+            "[!] Line: 3 message_id: '1234' not found in data",
+            "Verified 3 messages!",
+        ]